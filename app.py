@@ -1,46 +1,63 @@
 import streamlit as st
 import numpy as np
-import yaml
 import os
-from peakanalyzer.peakanalyzer import PeakAnalyzer
-import time
-from PIL import Image
+from matplotlib.figure import Figure
+from peakanalyzer.render import draw_image
+from peakanalyzer.service import AnalysisClient
 
 # Constants
 DATAFOLDER = "data/"
 WITH_CURRENT_DIR = os.path.join(DATAFOLDER, "with_current")
 WITHOUT_CURRENT_DIR = os.path.join(DATAFOLDER, "without_current")
-WINDOW_LENGTH = 20
-POLY_ORDER = 3
-NUM_PEAKS_IN_CLUSTER = 3
+CATALOG_PATH = os.path.join(DATAFOLDER, "catalog.sqlite")
+# The service catalogs the uploads, started with SERVICE_COMMAND
+SERVICE_COMMAND = f"python -m peakanalyzer.service --datafolder {DATAFOLDER} --catalog {CATALOG_PATH}"
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
 
 # Ensure directories exist
 os.makedirs(WITH_CURRENT_DIR, exist_ok=True)
 os.makedirs(WITHOUT_CURRENT_DIR, exist_ok=True)
 
 
-# Function to process files and display results
-def process_files(numpy_file, yaml_file, dir_type):
-    # Load numpy file
-    data = np.load(numpy_file)
-
-    # Load yaml file
-    with open(yaml_file, 'r') as stream:
-        yaml_data = yaml.safe_load(stream)
-
-    pa_obj = PeakAnalyzer(DATAFOLDER)
-
-    # (This is a placeholder. Replace with actual processing logic)
-    # For example, process the data and generate a plot
-    # Let's assume pa_obj has a method `generate_image` to create a plot image
-    image_path = os.path.join(dir_type, "output.png")
-    pa_obj.generate_image(data, yaml_data, image_path)
-
-    # Display the generated image
-    st.image(image_path, caption=f"Generated Image for {dir_type}", use_column_width=True)
-
-    # Show some numbers (Placeholder for actual numbers)
-    st.write(f"Processed {numpy_file} and {yaml_file} for {dir_type}")
+# Saves an uploaded .npy/.yaml pair and returns the acquisition's file name without extension
+def save_upload(numpy_file, yaml_file, directory):
+    fname = os.path.join(directory, os.path.splitext(numpy_file.name)[0])
+    with open(f"{fname}.npy", "wb") as f:
+        f.write(numpy_file.getbuffer())
+    with open(f"{fname}.yaml", "wb") as f:
+        f.write(yaml_file.getbuffer())
+    return fname
+
+
+# Submits the pair to the analysis service and shows its progress and the resulting shift map
+def process_files(idle_fname, active_fname):
+    client = AnalysisClient(SERVICE_HOST, SERVICE_PORT)
+    progress = st.progress(0, text="Submitting")
+    steps = {"queued": 0.1, "started": 0.2}
+    completed = 0
+    try:
+        for event in client.submit(idle_fname, active_fname):
+            if event["event"] in steps:
+                progress.progress(steps[event["event"]], text=event["event"].capitalize())
+            elif event["event"] == "partial":
+                completed += 1
+                progress.progress(0.2 + 0.4 * completed, text=f"Analysed {event['fname']}")
+                st.write(f"Mean deltas of {event['fname']} (Hz): {event['mean_deltas']}")
+            elif event["event"] == "error":
+                st.error(f"Analysis failed: {event['message']}")
+                return
+            elif event["event"] == "done":
+                progress.progress(1.0, text="Done (cached)" if event["cached"] else "Done")
+                shift_map = np.array(event["shift_map"], dtype=float)
+                for i, mean_shift in enumerate(event["mean_shift"]):
+                    figure = Figure()
+                    draw_image(figure, shift_map[i], title=f"Shift map of delta {i + 1}")
+                    st.pyplot(figure)
+                    st.write(f"Mean shift of delta {i + 1}: {mean_shift} Hz")
+    except ConnectionError:
+        st.error(f"The analysis service is not running on {SERVICE_HOST}:{SERVICE_PORT}, "
+                 f"start it with: {SERVICE_COMMAND}")
 
 
 # Streamlit app
@@ -60,34 +77,13 @@ def main():
                                             key="without_current_yaml")
 
     if st.button("Detect Peaks"):
-        if with_current_numpy and with_current_yaml:
-            with_current_numpy_path = os.path.join(WITH_CURRENT_DIR, with_current_numpy.name)
-            with_current_yaml_path = os.path.join(WITH_CURRENT_DIR, with_current_yaml.name)
-
-            # Save uploaded files
-            with open(with_current_numpy_path, "wb") as f:
-                f.write(with_current_numpy.getbuffer())
-            with open(with_current_yaml_path, "wb") as f:
-                f.write(with_current_yaml.getbuffer())
-
-            # Process and display results for 'with current'
-            process_files(with_current_numpy_path, with_current_yaml_path, "with_current")
-
-        if without_current_numpy and without_current_yaml:
-            without_current_numpy_path = os.path.join(WITHOUT_CURRENT_DIR, without_current_numpy.name)
-            without_current_yaml_path = os.path.join(WITHOUT_CURRENT_DIR, without_current_yaml.name)
-
-            # Save uploaded files
-            with open(without_current_numpy_path, "wb") as f:
-                f.write(without_current_numpy.getbuffer())
-            with open(without_current_yaml_path, "wb") as f:
-                f.write(without_current_yaml.getbuffer())
-
-            # Process and display results for 'without current'
-            process_files(without_current_numpy_path, without_current_yaml_path, "without_current")
-
-
+        if not (with_current_numpy and with_current_yaml and without_current_numpy and without_current_yaml):
+            st.warning("Upload the numpy and yaml files of both categories.")
+            return
+        active_fname = save_upload(with_current_numpy, with_current_yaml, WITH_CURRENT_DIR)
+        idle_fname = save_upload(without_current_numpy, without_current_yaml, WITHOUT_CURRENT_DIR)
+        process_files(idle_fname, active_fname)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.synthetic import generate_dataset
+
+DATAFOLDER = "data_dir/"
+WINDOW_LENGTH = 20
+POLY_ORDER = 3
+REPEATS = 3
+IMAGE_SIDE = 4
+
+
+class CountingPeakAnalyzer(PeakAnalyzer):
+    def __init__(self, datafolder):
+        super().__init__(datafolder)
+        self.model_calls = 0
+        self.jacobian_calls = 0
+
+    def fit_all_clusters(self, x, *params):
+        self.model_calls += 1
+        return super().fit_all_clusters(x, *params)
+
+    def fit_all_clusters_jacobian(self, x, *params):
+        self.jacobian_calls += 1
+        return super().fit_all_clusters_jacobian(x, *params)
+
+    def fit_cluster(self, x, *params):
+        self.model_calls += 1
+        return super().fit_cluster(x, *params)
+
+    def fit_cluster_jacobian(self, x, *params):
+        self.jacobian_calls += 1
+        return super().fit_cluster_jacobian(x, *params)
+
+
+def load_spectrum(pa_obj, fname):
+    # Use the recorded cube when it is available, otherwise synthesise a spectrum on the
+    # bundled frequency axis with the same inverted triple Lorentzian shape
+    if os.path.isfile(f"{fname}.npy"):
+        frq, data, step_intervals = pa_obj.load_data(fname)
+        return frq, pa_obj.normalise_dataset(data)[:, 0, 0], step_intervals
+    frq, step_intervals = pa_obj.load_metadata(fname)
+    frq, raw, step_intervals, _ = generate_dataset(pa_obj, height=1, width=1, frq=frq, step_intervals=step_intervals,
+                                                   seed=0)
+    return frq, pa_obj.normalise_dataset(raw)[:, 0, 0], step_intervals
+
+
+if __name__ == "__main__":
+    pa_obj = CountingPeakAnalyzer(DATAFOLDER)
+    fname = os.path.join(DATAFOLDER, "without_current", "ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50")
+    frq, spectrum, step_intervals = load_spectrum(pa_obj, fname)
+    frq_clipped, smooth_clipped, clipped_step_intervals, peaks = pa_obj.analyse_dataset(
+        frq, spectrum, step_intervals, window_length=WINDOW_LENGTH, poly_order=POLY_ORDER)
+
+    modes = {
+        "finite differences": lambda: pa_obj.curve_fitting(frq_clipped, smooth_clipped, peaks,
+                                                           analytic_jacobian=False),
+        "analytic jacobian": lambda: pa_obj.curve_fitting(frq_clipped, smooth_clipped, peaks),
+        "per cluster": lambda: pa_obj.curve_fitting_by_cluster(frq_clipped, smooth_clipped, peaks,
+                                                               clipped_step_intervals),
+    }
+
+    timings = {}
+    for label, fit in modes.items():
+        pa_obj.model_calls = pa_obj.jacobian_calls = 0
+        start_time = time.perf_counter()
+        for _ in range(REPEATS):
+            popt, pcov = fit()
+        timings[label] = (time.perf_counter() - start_time) / REPEATS
+        print(f"{label:>20}: {timings[label]:.3f} s/fit, {pa_obj.model_calls // REPEATS} model evaluations, "
+              f"{pa_obj.jacobian_calls // REPEATS} jacobian evaluations")
+    for label in list(modes)[1:]:
+        print(f"Speedup of {label} over finite differences: {timings['finite differences'] / timings[label]:.1f}x")
+
+    # Full image per cluster fits, every pixel starting from its own guesses or from its neighbours
+    frq, raw, step_intervals, _ = generate_dataset(pa_obj, height=IMAGE_SIDE, width=IMAGE_SIDE, seed=0)
+    frq_clipped, smooth_clipped, clipped_step_intervals, peaks = pa_obj.analyse_dataset(
+        frq, pa_obj.normalise_dataset(raw), step_intervals, window_length=WINDOW_LENGTH, poly_order=POLY_ORDER)
+    image_timings = {}
+    for warm_start in (False, True):
+        label = "warm started image" if warm_start else "cold started image"
+        pa_obj.metrics.reset()
+        start_time = time.perf_counter()
+        pa_obj.curve_fitting_image(frq_clipped, smooth_clipped, peaks, step_intervals=clipped_step_intervals,
+                                   warm_start=warm_start)
+        image_timings[label] = (time.perf_counter() - start_time) / IMAGE_SIDE ** 2
+        stages = pa_obj.metrics.stages
+        print(f"{label:>20}: {image_timings[label]:.3f} s/pixel, "
+              f"{stages['curve_fitting_cluster']['nfev'] // IMAGE_SIDE ** 2} function evaluations/pixel, "
+              f"{stages['curve_fitting_cluster']['failures']} failed cluster fits, "
+              f"{stages.get('warm_start_fallback', {}).get('calls', 0)} fallbacks")
+    print(f"Speedup of warm started over cold started image: "
+          f"{image_timings['cold started image'] / image_timings['warm started image']:.1f}x")
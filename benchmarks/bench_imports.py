@@ -0,0 +1,53 @@
+import argparse
+import os
+import subprocess
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that must not be imported by the compute core
+HEAVY_MODULES = ("matplotlib", "plotly", "esr", "scipy.optimize", "scipy.signal", "scipy.ndimage")
+MODULES = ["peakanalyzer.peakanalyzer", "peakanalyzer.batch", "peakanalyzer.streaming", "peakanalyzer.service",
+           "peakanalyzer.preview"]
+# Importing the core and smoothing once, which is when scipy.signal is loaded
+FIRST_SMOOTH = ("import numpy as np; from peakanalyzer.peakanalyzer import PeakAnalyzer; "
+                "PeakAnalyzer('data_dir/').smooth_data(np.zeros((40, 4)), window_length=20, axis=0)")
+SCRIPT = """import sys, time
+start_time = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start_time
+print(elapsed, *[name for name in {heavy!r} if name in sys.modules])
+"""
+
+
+def time_statement(statement):
+    # Every measurement runs in a fresh interpreter, as a worker or CLI invocation would
+    output = subprocess.run([sys.executable, "-c", SCRIPT.format(statement=statement, heavy=HEAVY_MODULES)],
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), output[1:]
+
+
+def run(statement, repeats):
+    timings, loaded = [], []
+    for _ in range(repeats):
+        elapsed, loaded = time_statement(statement)
+        timings.append(elapsed)
+    return np.median(timings), loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time importing the peakanalyzer modules in fresh interpreters")
+    parser.add_argument("--repeats", type=int, default=5, help="No. of interpreters per module, the median is reported")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="Exit with an error when importing peakanalyzer.peakanalyzer takes longer")
+    args = parser.parse_args()
+
+    core_time = None
+    print(f"{'statement':<28} {'median':>9}  heavy modules loaded")
+    for name, statement in [(module, f"import {module}") for module in MODULES] + [("first smooth", FIRST_SMOOTH)]:
+        median, loaded = run(statement, args.repeats)
+        if name == "peakanalyzer.peakanalyzer":
+            core_time = median
+        print(f"{name:<28} {median * 1e3:>7.1f}ms  {', '.join(loaded) or '-'}")
+    if args.max_seconds is not None and core_time > args.max_seconds:
+        sys.exit(f"Importing peakanalyzer.peakanalyzer took {core_time:.3f}s, more than {args.max_seconds}s")
@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.synthetic import generate_dataset, save_dataset
+
+DATAFOLDER = "data_dir/"
+WINDOW_LENGTH = 20
+POLY_ORDER = 3
+# (image side, points per step interval, sweeps)
+SIZES = [(10, 151, 4), (25, 151, 4), (50, 151, 4), (50, 301, 4), (50, 151, 16)]
+QUICK_SIZES = [(10, 151, 4), (25, 151, 4)]
+
+
+def time_stage(timings, stage, func, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start_time
+    return result
+
+
+def run_size(pa_obj, tmp_dir, side, points_per_interval, num_sweeps, fit_pixels, seed=0):
+    frq, raw, step_intervals, true_centres = generate_dataset(pa_obj, height=side, width=side,
+                                                              points_per_interval=points_per_interval,
+                                                              num_sweeps=num_sweeps, seed=seed)
+    fname = os.path.join(tmp_dir, f"synthetic_{side}x{side}_{points_per_interval}_{num_sweeps}")
+    save_dataset(fname, frq, raw, step_intervals)
+    del raw
+
+    timings = {}
+    frq, raw, step_intervals = time_stage(timings, "load", pa_obj.load_data, fname)
+    data = time_stage(timings, "normalise", pa_obj.normalise_dataset, raw)
+    smooth = time_stage(timings, "smooth", pa_obj.smooth_data, data, window_length=WINDOW_LENGTH,
+                        poly_order=POLY_ORDER, axis=0)
+    frq_clipped, smooth_clipped, clipped_step_intervals = pa_obj.clip_dataset(frq, smooth, step_intervals)
+    peaks = time_stage(timings, "peaks", pa_obj.get_peaks_batch, smooth_clipped, clipped_step_intervals)
+    refined_peaks = time_stage(timings, "refine", pa_obj.refine_peaks, smooth_clipped, peaks)
+
+    # Fitting is orders of magnitude slower, so only the first fit_pixels of the image are fitted
+    fit_smooth = smooth_clipped.reshape(len(smooth_clipped), -1)[:, :fit_pixels]
+    fit_peaks = peaks.reshape(len(peaks), -1)[:, :fit_pixels]
+    popt = time_stage(timings, "fit", pa_obj.curve_fitting_image, frq_clipped, fit_smooth, fit_peaks,
+                      step_intervals=clipped_step_intervals)
+    timings["fit"] /= max(fit_pixels, 1)
+
+    found = peaks >= 0
+    peak_error = np.abs(frq_clipped[np.maximum(peaks, 0)] - true_centres)[found]
+    # Deltas are compared rather than centres: smoothing biases the dip centres symmetrically
+    # within a cluster, which cancels in the cluster means the deltas are built from
+    true_clusters = np.mean(true_centres.reshape(6, 3, *true_centres.shape[1:]), axis=1)
+    true_deltas = np.abs(true_clusters[:3] - true_clusters[:2:-1])
+    delta_error = np.abs(pa_obj.get_peaks_delta_batch(peaks, frq_clipped) - true_deltas)
+    refined_delta_error = np.abs(pa_obj.get_peaks_delta_batch(refined_peaks, frq_clipped) - true_deltas)
+    fit_centres = popt[1::3]
+    fit_true_centres = true_centres.reshape(len(true_centres), -1)[:, :fit_pixels]
+    fit_error = np.abs(fit_centres - fit_true_centres)[np.isfinite(fit_centres)]
+    return timings, {
+        "peak_error_khz": np.median(peak_error) * 1e-3 if len(peak_error) else np.nan,
+        "delta_error_khz": np.nanmedian(delta_error) * 1e-3,
+        "refined_delta_error_khz": np.nanmedian(refined_delta_error) * 1e-3,
+        "fit_error_khz": np.median(fit_error) * 1e-3 if len(fit_error) else np.nan,
+        "missing_peaks": int(np.sum(~found)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic ESR cubes")
+    parser.add_argument("--quick", action="store_true", help="Only run the small sizes")
+    parser.add_argument("--fit-pixels", type=int, default=5, help="No. of pixels to fit per size")
+    args = parser.parse_args()
+
+    pa_obj = PeakAnalyzer(DATAFOLDER)
+    stages = ["load", "normalise", "smooth", "peaks", "refine", "fit"]
+    print(f"{'pixels':>8} {'points':>7} {'sweeps':>7} " + " ".join(f"{stage + ' [s]':>13}" for stage in stages) +
+          f" {'peak err kHz':>13} {'delta err kHz':>14} {'refined kHz':>12} {'fit err kHz':>12} {'missing':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for side, points_per_interval, num_sweeps in (QUICK_SIZES if args.quick else SIZES):
+            timings, accuracy = run_size(pa_obj, tmp_dir, side, points_per_interval, num_sweeps, args.fit_pixels)
+            print(f"{side * side:>8} {points_per_interval * 6:>7} {num_sweeps:>7} " +
+                  " ".join(f"{timings[stage]:>13.4f}" for stage in stages) +
+                  f" {accuracy['peak_error_khz']:>13.1f} {accuracy['delta_error_khz']:>14.1f}"
+                  f" {accuracy['refined_delta_error_khz']:>12.1f}"
+                  f" {accuracy['fit_error_khz']:>12.1f} {accuracy['missing_peaks']:>8}")
+    print("fit time is per pixel, errors are medians of |detected - true| dip centre or delta (grid and refined)")
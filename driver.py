@@ -1,96 +1,154 @@
+import argparse
 import numpy as np
 from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.batch import BatchRunner
+from peakanalyzer.cache import StageCache
+from peakanalyzer.calibration import CalibrationStore
+from peakanalyzer.preview import PreviewRunner
+from peakanalyzer.catalog import AcquisitionCatalog
+from peakanalyzer.render import RENDER_MODES, Renderer
 import time
 
 DATAFOLDER = "data/"
 WINDOW_LENGTH = 20
 POLY_ORDER = 3
-NUM_PEAKS_IN_CLUSTER = 3
+NORMALISE_BLOCK_SIZE = 16
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect ESR dips and compare idle and active acquisitions")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="No. of worker processes for per-file preprocessing and curve fitting")
+    parser.add_argument("--fit-image", action="store_true",
+                        help="Fit every pixel of each acquisition instead of only pixel (0,0)")
+    parser.add_argument("--warm-start", action="store_true",
+                        help="With --fit-image, seed every pixel's fit with its already fitted neighbours")
+    parser.add_argument("--plots", choices=RENDER_MODES, default="show",
+                        help="Show plots interactively, write them to --plot-dir or skip plotting")
+    parser.add_argument("--plot-dir", default="plots/", help="Output folder for --plots file")
+    parser.add_argument("--catalog", default=None,
+                        help="SQLite acquisition catalog used instead of listing the data folder")
+    parser.add_argument("--metrics", default=None,
+                        help="Write per-stage timings of this run to a .json or .csv file")
+    parser.add_argument("--calibration-dir", default=None,
+                        help="Store idle reference results here and reuse them while they are still valid")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Keep intermediate stage results in this folder and reuse them across runs")
+    parser.add_argument("--cache-size", type=float, default=4.0,
+                        help="Maximum size of --cache-dir in GiB, least recently used entries are evicted")
+    parser.add_argument("--float32", action="store_true",
+                        help="Keep the normalised and smoothed cubes in single precision, fits stay in double")
+    parser.add_argument("--refine", choices=["parabolic", "centroid"], default=None,
+                        help="Refine detected dips to sub-sample positions before computing the deltas")
+    parser.add_argument("--preview", type=int, default=None, metavar="FACTOR",
+                        help="Bin FACTOR x FACTOR pixels for a quick shift map and only process the pixels "
+                             "around large shifts at full resolution")
+    parser.add_argument("--roi-threshold", type=float, default=100e3,
+                        help="Shift in Hz above which --preview processes pixels at full resolution")
+    args = parser.parse_args()
+
     try:
         # Create PeakAnalyzer object
-        pa_obj = PeakAnalyzer(DATAFOLDER)
-
-        start_time = time.time()
+        catalog = AcquisitionCatalog(args.catalog) if args.catalog else None
+        pa_obj = PeakAnalyzer(DATAFOLDER, renderer=Renderer(args.plots, output_dir=args.plot_dir), catalog=catalog)
 
         # Load all filenames
         idle_filenames = pa_obj.get_idle_fname_list()
         active_filenames = pa_obj.get_active_fname_list()
 
-        for idle_fname in idle_filenames:
-            for active_fname in active_filenames:
+        # Load, normalise, smooth, clip and find peaks (dips in our case) for every acquisition once
+        cache = StageCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+        calibrations = CalibrationStore(args.calibration_dir) if args.calibration_dir else None
+        runner = BatchRunner(pa_obj, window_length=WINDOW_LENGTH, poly_order=POLY_ORDER,
+                             block_size=NORMALISE_BLOCK_SIZE, workers=args.workers,
+                             fit=args.fit_image, cache=cache, refine=args.refine,
+                             warm_start=args.warm_start, calibrations=calibrations,
+                             dtype=np.float32 if args.float32 else None)
+
+        # Statistics of the raw data (and their plots) are printed before the measured span
+        for fname in dict.fromkeys(list(idle_filenames) + list(active_filenames)):
+            try:
+                pa_obj.print_data_statistics(pa_obj.load_data(fname, mmap=True)[1])
+            except Exception as e:
+                print(f"Error reading {fname}: {str(e)}")
+
+        if args.preview:
+            # Coarse shift maps first, full resolution processing (and fitting) only where they are large
+            previewer = PreviewRunner(runner, factor=args.preview, threshold=args.roi_threshold)
+            start_time = time.perf_counter()
+            for idle_fname in idle_filenames:
+                for active_fname in active_filenames:
+                    try:
+                        preview = previewer.run(idle_fname, active_fname)
+                        print(f"Refined {np.mean(preview.roi) * 100:.1f}% of the image at full resolution")
+                        shift_map = preview.shift_map * 1e-9
+                        print(f"Mean Difference Between 1-6 Peak Over Image:{np.nanmean(shift_map[0])}")
+                        print(f"Mean Difference Between 2-5 Peak Over Image:{np.nanmean(shift_map[1])}")
+                        print(f"Mean Difference Between 3-4 Peak Over Image:{np.nanmean(shift_map[2])}")
+                        pa_obj.plot_image(shift_map[0], title="Difference Between 1-6 Peak (Preview) [GHz]")
+                    except Exception as e:
+                        print(f"Error processing files {idle_fname} and {active_fname}: {str(e)}")
+            print(f"Total execution time of the preview: {time.perf_counter() - start_time} seconds")
+        else:
+            start_time = time.perf_counter()
+            results, shift_maps = runner.run(idle_filenames, active_filenames)
+            end_time = time.perf_counter()
+            for fname, e in runner.errors.items():
+                print(f"Error processing {fname}: {str(e)}")
+
+            for (idle_fname, active_fname), shift_map in shift_maps.items():
                 try:
-                    # Load data
-                    idle_frq, idle_data, idle_step_intervals = pa_obj.load_data(idle_fname)
-                    active_frq, active_data, active_step_intervals = pa_obj.load_data(active_fname)
-
-                    # Print statistics
-                    pa_obj.print_data_statistics(idle_data)
-                    pa_obj.print_data_statistics(active_data)
-
-                    # Normalize
-                    idle_data = pa_obj.normalise_dataset(idle_data)
-                    active_data = pa_obj.normalise_dataset(active_data)
-
-                    # Smooth data
-                    idle_smooth = pa_obj.smooth_data(idle_data[:, 0, 0], window_length=WINDOW_LENGTH, poly_order=POLY_ORDER)
-                    active_smooth = pa_obj.smooth_data(active_data[:, 0, 0], window_length=WINDOW_LENGTH, poly_order=POLY_ORDER)
-
-                    # Clipping outliers/tails
-                    idle_clip_range = pa_obj.get_clip_range(idle_step_intervals)
-                    idle_step_intervals[0] -= idle_clip_range
-                    idle_step_intervals[-1] -= idle_clip_range
-                    idle_smooth_clipped, idle_frq_clipped = idle_smooth[idle_clip_range:-idle_clip_range], idle_frq[idle_clip_range:-idle_clip_range]
-                    active_clip_range = pa_obj.get_clip_range(active_step_intervals)
-                    active_step_intervals[0] -= active_clip_range
-                    active_step_intervals[-1] -= active_clip_range
-                    active_smooth_clipped, active_frq_clipped = active_smooth[active_clip_range:-active_clip_range], active_frq[active_clip_range:-active_clip_range]
-
-                    # Find peaks (dips in our case)
-                    # Process array in chunks
-                    idle_chunked_list = pa_obj.chunk_array_by_sizes(idle_smooth_clipped, idle_step_intervals)
-                    active_chunked_list = pa_obj.chunk_array_by_sizes(active_smooth_clipped, active_step_intervals)
-
-                    active_start_step = 0
-                    active_peak_list = []
-                    idle_start_step = 0
-                    idle_peak_list = []
-
-                    for idle_chunk_data, active_chunk_data in zip(idle_chunked_list, active_chunked_list):
-                        idle_peaks, _ = pa_obj.get_peaks(idle_chunk_data)
-                        idle_peak_heights = [(idle_chunk_data[peak], peak + idle_start_step) for peak in idle_peaks]
-                        # Sort peaks based on height i.e. get the 3 main peaks in the segment
-                        idle_sorted_peak_list = sorted(idle_peak_heights, key=lambda x: x[0])[:NUM_PEAKS_IN_CLUSTER]
-                        idle_start_step += len(idle_chunk_data)
-                        idle_peak_list.extend(idle_sorted_peak_list)
-                        active_peaks, _ = pa_obj.get_peaks(active_chunk_data)
-                        active_peak_heights = [(active_chunk_data[peak], peak + active_start_step) for peak in active_peaks]
-                        active_sorted_peak_list = sorted(active_peak_heights, key=lambda x: x[0])[:NUM_PEAKS_IN_CLUSTER]
-                        active_start_step += len(active_chunk_data)
-                        active_peak_list.extend(active_sorted_peak_list)
-
-                    # Sort peaks based on index i.e. get the right order of peaks
-                    sorted_idle_peaks = sorted(idle_peak_list, key=lambda x: x[1])
-                    sorted_idle_peaks = np.array([p[1] for p in sorted_idle_peaks])
-                    sorted_active_peaks = sorted(active_peak_list, key=lambda x: x[1])
-                    sorted_active_peaks = np.array([p[1] for p in sorted_active_peaks])
-
-                    # Visualize peaks
-                    pa_obj.visualise_peaks(idle_frq_clipped, idle_smooth_clipped, sorted_idle_peaks, 'Detected and Filtered Peaks in the Idle Wave', color="#E493B3")
-                    pa_obj.visualise_peaks(active_frq_clipped, active_smooth_clipped, sorted_active_peaks, 'Detected and Filtered Peaks in the Active Wave', color="#51829B")
-
-                    pa_obj.print_results(sorted_idle_peaks, idle_frq_clipped, sorted_active_peaks, active_frq_clipped)
-                    end_time = time.time()
-                    print(f"Total execution time without curve fitting: {end_time - start_time} seconds")
-
-                    # Additionally fit a curve using triple lorentzian distribution
-                    idle_wave_parameters = pa_obj.curve_fitting(idle_frq_clipped, idle_smooth_clipped,
-                                                                sorted_idle_peaks)
-                    active_wave_parameters = pa_obj.curve_fitting(active_frq_clipped, active_smooth_clipped,
-                                                                  sorted_active_peaks)
-
+                    idle_result, active_result = results[idle_fname], results[active_fname]
+
+                    # Splitting deltas for every pixel of the image
+                    shift_map = shift_map * 1e-9
+                    print(f"Mean Difference Between 1-6 Peak Over Image:{np.nanmean(shift_map[0])}")
+                    print(f"Mean Difference Between 2-5 Peak Over Image:{np.nanmean(shift_map[1])}")
+                    print(f"Mean Difference Between 3-4 Peak Over Image:{np.nanmean(shift_map[2])}")
+                    pa_obj.plot_image(shift_map[0], title="Difference Between 1-6 Peak [GHz]")
+
+                    # Visualize peaks of pixel (0,0), references loaded from a calibration have no spectra
+                    if idle_result.smooth is not None:
+                        pa_obj.visualise_peaks(idle_result.frq, idle_result.smooth[:, 0, 0], idle_result.peaks[:, 0, 0],
+                                               'Detected and Filtered Peaks in the Idle Wave', color="#E493B3")
+                    pa_obj.visualise_peaks(active_result.frq, active_result.smooth[:, 0, 0],
+                                           active_result.peaks[:, 0, 0],
+                                           'Detected and Filtered Peaks in the Active Wave', color="#51829B")
+
+                    idle_peaks = idle_result.peaks if idle_result.refined_peaks is None else idle_result.refined_peaks
+                    active_peaks = (active_result.peaks if active_result.refined_peaks is None
+                                    else active_result.refined_peaks)
+                    pa_obj.print_results(idle_peaks[:, 0, 0], idle_result.frq, active_peaks[:, 0, 0], active_result.frq)
                 except Exception as e:
                     print(f"Error processing files {idle_fname} and {active_fname}: {str(e)}")
+            # Plotting and printing are not part of the measured span
+            if args.fit_image:
+                print(f"Total execution time with full image curve fitting: {end_time - start_time} seconds")
+            else:
+                print(f"Total execution time without curve fitting: {end_time - start_time} seconds")
+
+            # Additionally fit a curve using triple lorentzian distribution, once per acquisition
+            wave_parameters = {}
+            for fname, result in results.items():
+                try:
+                    if args.fit_image:
+                        # Fitted (and cached) by the runner together with the other stages
+                        wave_parameters[fname] = result.popt
+                    elif result.smooth is None:
+                        # Calibrated reference, which was only fitted if it was built with --fit-image
+                        continue
+                    else:
+                        wave_parameters[fname] = pa_obj.curve_fitting(result.frq, result.smooth[:, 0, 0],
+                                                                      result.peaks[:, 0, 0])
+                except Exception as e:
+                    print(f"Error fitting {fname}: {str(e)}")
+
+        # Wait for plots that are still being written in the background
+        pa_obj.renderer.close()
+        for e in pa_obj.renderer.errors:
+            print(f"Error rendering plot: {str(e)}")
+
+        print(pa_obj.metrics.summary())
+        if args.metrics:
+            pa_obj.metrics.export(args.metrics)
     except Exception as e:
         print(f"Failed to initialize PeakAnalyzer with data folder '{DATAFOLDER}': {str(e)}")
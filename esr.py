@@ -18,7 +18,8 @@ import yaml
 #     fig.add_trace(go.Scatter(x=x, y=y, mode="lines+markers", name=yn))
 #     fig.update_layout(title=title, xaxis_title=xaxis_title, yaxis_title=yaxis_title)
 #     fig.show()
-def linep2dp(x: np.ndarray, y: list, yn="", title="", xaxis_title="x", yaxis_title="y", color="#9BB0C1") -> None:
+def linep2dp(x: np.ndarray, y: list, yn="", title="", xaxis_title="x", yaxis_title="y", color="#9BB0C1",
+             output_path=None) -> None:
     """Multi-line 2D plot using plotly.
 
     :param x: x-axis values.
@@ -27,6 +28,7 @@ def linep2dp(x: np.ndarray, y: list, yn="", title="", xaxis_title="x", yaxis_tit
     :param title: Title of the plot.
     :param xaxis_title: Title of the x-axis.
     :param yaxis_title: Title of the y-axis.
+    :param output_path: Write the plot to this HTML file instead of showing it.
     """
     import plotly.graph_objects as go
     fig = go.Figure()
@@ -49,7 +51,10 @@ def linep2dp(x: np.ndarray, y: list, yn="", title="", xaxis_title="x", yaxis_tit
     )
 
     # Show plot
-    fig.show()
+    if output_path is not None:
+        fig.write_html(output_path)
+    else:
+        fig.show()
 
 
 if __name__ == "__main__":
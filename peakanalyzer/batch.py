@@ -0,0 +1,204 @@
+import numpy as np
+
+
+class AcquisitionResult:
+    def __init__(self, fname, frq, smooth, step_intervals, peaks, deltas, popt=None, refined_peaks=None):
+        self.fname = fname
+        # Clipped frequency axis and the matching smoothed (frequency, row, col) spectra
+        self.frq = frq
+        self.smooth = smooth
+        self.step_intervals = step_intervals
+        # Peak indices sorted by frequency (18, row, col) and splitting deltas (3, row, col)
+        self.peaks = peaks
+        self.deltas = deltas
+        # Sub-sample (fractional index) peak positions the deltas were computed from, if refined
+        self.refined_peaks = refined_peaks
+        # Fitted Lorentzian parameters (54, row, col) when the runner fits the full image
+        self.popt = popt
+
+
+class BatchRunner:
+    def __init__(self, analyzer, window_length=15, poly_order=3, clip_percentage=.10, distance=5,
+                 block_size=None, print_statistics=False, workers=None, fit=False, fit_depth=200000, cache=None,
+                 refine=None, warm_start=False, calibrations=None, dtype=None):
+        self.analyzer = analyzer
+        self.window_length = window_length
+        self.poly_order = poly_order
+        self.clip_percentage = clip_percentage
+        self.distance = distance
+        self.block_size = block_size
+        self.print_statistics = print_statistics
+        self.workers = workers
+        self.fit = fit
+        self.fit_depth = fit_depth
+        self.cache = cache
+        self.refine = refine
+        self.warm_start = warm_start
+        self.calibrations = calibrations
+        # Precision of the normalised and smoothed cubes and the peak search, e.g. np.float32
+        self.dtype = dtype
+        self.errors = {}
+
+    def stage_key(self, parent_key, stage, **params):
+        return None if self.cache is None else self.cache.key(parent_key, stage, **params)
+
+    def stage(self, key, compute):
+        # Returns the stage output from the cache when possible, computing (and storing) it otherwise
+        if self.cache is None:
+            return compute()
+        arrays = self.cache.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.cache.put(key, arrays)
+        return arrays
+
+    def normalise(self, fname):
+        _, data, _ = self.analyzer.load_data(fname, mmap=True)
+        if self.print_statistics:
+            self.analyzer.print_data_statistics(data)
+        return {"data": self.analyzer.normalise_dataset(data, block_size=self.block_size, dtype=self.dtype)}
+
+    def smooth(self, fname, normalise_key):
+        data = self.stage(normalise_key, lambda: self.normalise(fname))["data"]
+        return {"smooth": self.analyzer.smooth_data(data, window_length=self.window_length,
+                                                    poly_order=self.poly_order, axis=0)}
+
+    def clip(self, fname):
+        frq, step_intervals = self.analyzer.load_metadata(fname)
+        clip_range = self.analyzer.get_clip_range(step_intervals, self.clip_percentage)
+        frq_clipped, _, clipped_step_intervals = self.analyzer.clip_dataset(frq, frq, step_intervals,
+                                                                            self.clip_percentage)
+        return {"frq": frq_clipped, "step_intervals": clipped_step_intervals, "clip_range": np.array(clip_range)}
+
+    def normalise_key(self, input_key):
+        return self.stage_key(input_key, "normalise", dtype=None if self.dtype is None else np.dtype(self.dtype).str)
+
+    def normalised(self, fname):
+        # Normalised (frequency, row, col) cube of an acquisition, from the cache when possible
+        input_key = None if self.cache is None else self.cache.input_key(fname)
+        return self.stage(self.normalise_key(input_key), lambda: self.normalise(fname))["data"]
+
+    def analyse(self, fname, frq, data, step_intervals, fit=None, warm_start=None):
+        # The stages after normalisation for a cube that is already in memory, e.g. a binned or
+        # cropped one; fit and warm_start default to the runner's settings
+        frq_clipped, smooth_clipped, clipped_step_intervals, peaks = self.analyzer.analyse_dataset(
+            frq, data, step_intervals, window_length=self.window_length, poly_order=self.poly_order,
+            clip_percentage=self.clip_percentage, distance=self.distance)
+        refined_peaks = None
+        if self.refine is not None:
+            refined_peaks = self.analyzer.refine_peaks(smooth_clipped, peaks, self.refine)
+        deltas = self.analyzer.get_peaks_delta_batch(peaks if refined_peaks is None else refined_peaks, frq_clipped)
+        popt = None
+        if self.fit if fit is None else fit:
+            popt = self.analyzer.curve_fitting_image(frq_clipped, smooth_clipped, peaks,
+                                                     step_intervals=clipped_step_intervals, depth=self.fit_depth,
+                                                     workers=self.workers,
+                                                     warm_start=self.warm_start if warm_start is None else warm_start)
+        return AcquisitionResult(fname, frq_clipped, smooth_clipped, clipped_step_intervals, peaks, deltas, popt,
+                                 refined_peaks)
+
+    def preprocess(self, fname, fit_workers=None):
+        # Every stage is keyed on its inputs and parameters, so with a cache a parameter sweep only
+        # recomputes the stages downstream of the parameter that changed. fit_workers shards the
+        # pixels of the fit over that many processes.
+        input_key = None if self.cache is None else self.cache.input_key(fname)
+        normalise_key = self.normalise_key(input_key)
+        smooth_key = self.stage_key(normalise_key, "smooth", window_length=self.window_length,
+                                    poly_order=self.poly_order)
+        smooth = self.stage(smooth_key, lambda: self.smooth(fname, normalise_key))["smooth"]
+
+        clip_key = self.stage_key(input_key, "clip", clip_percentage=self.clip_percentage)
+        clipped = self.stage(clip_key, lambda: self.clip(fname))
+        frq_clipped, clipped_step_intervals = clipped["frq"], clipped["step_intervals"]
+        clip_range = int(clipped["clip_range"])
+        smooth_clipped = smooth[clip_range:clip_range + len(frq_clipped)]
+
+        peaks_key = self.stage_key(smooth_key, "peaks", clip_key=clip_key, distance=self.distance)
+        peaks = self.stage(peaks_key, lambda: {"peaks": self.analyzer.get_peaks_batch(
+            smooth_clipped, clipped_step_intervals, distance=self.distance)})["peaks"]
+        refined_peaks = None
+        if self.refine is not None:
+            refined_peaks = self.analyzer.refine_peaks(smooth_clipped, peaks, self.refine)
+        deltas = self.analyzer.get_peaks_delta_batch(peaks if refined_peaks is None else refined_peaks, frq_clipped)
+
+        popt = None
+        if self.fit:
+            fit_key = self.stage_key(peaks_key, "fit", depth=self.fit_depth, warm_start=self.warm_start)
+            popt = self.stage(fit_key, lambda: {"popt": self.analyzer.curve_fitting_image(
+                frq_clipped, smooth_clipped, peaks, step_intervals=clipped_step_intervals,
+                depth=self.fit_depth, workers=fit_workers, warm_start=self.warm_start)})["popt"]
+        return AcquisitionResult(fname, frq_clipped, smooth_clipped, clipped_step_intervals, peaks, deltas, popt,
+                                 refined_peaks)
+
+    def calibration_params(self):
+        # Everything that changes a reference result; block_size and workers don't
+        return {"window_length": self.window_length, "poly_order": self.poly_order,
+                "clip_percentage": self.clip_percentage, "distance": self.distance, "refine": self.refine,
+                "dtype": None if self.dtype is None else np.dtype(self.dtype).str,
+                "fit": self.fit, "fit_depth": self.fit_depth if self.fit else None,
+                "warm_start": self.warm_start if self.fit else None}
+
+    def preprocess_in_worker(self, fname):
+        # Runs in a worker process, hands the worker's metrics back with the result
+        self.analyzer.metrics.reset()
+        return self.preprocess(fname), self.analyzer.metrics.stages
+
+    def preprocess_all(self, fnames):
+        # Workers load their own files, only the file names and the results cross processes. When
+        # fitting fewer files than there are workers, the files are processed in turn and the
+        # workers share the pixels of each fit instead.
+        fnames = list(dict.fromkeys(fnames))
+        parallel = self.workers is not None and self.workers > 1
+        shard_pixels = parallel and self.fit and len(fnames) < self.workers
+        if parallel and not shard_pixels:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self.preprocess_in_worker, fname) for fname in fnames]
+        else:
+            futures = None
+        results = {}
+        for i, fname in enumerate(fnames):
+            try:
+                if futures:
+                    results[fname], stages = futures[i].result()
+                    self.analyzer.metrics.merge(stages)
+                else:
+                    results[fname] = self.preprocess(fname, fit_workers=self.workers if shard_pixels else None)
+            except Exception as e:
+                self.errors[fname] = e
+        return results
+
+    def compare(self, idle_result, active_result):
+        if idle_result.deltas.shape != active_result.deltas.shape:
+            raise ValueError("Idle and active acquisitions have different image shapes")
+        return active_result.deltas - idle_result.deltas
+
+    def run(self, idle_fnames, active_fnames):
+        # Every acquisition is processed exactly once, the pairings only combine the cached deltas.
+        # With calibrations, references that were calibrated before are loaded instead of processed.
+        references = {}
+        if self.calibrations is not None:
+            for fname in idle_fnames:
+                reference = self.calibrations.load(fname, self.calibration_params())
+                if reference is not None:
+                    references[fname] = reference
+        results = self.preprocess_all([fname for fname in idle_fnames if fname not in references] +
+                                      list(active_fnames))
+        if self.calibrations is not None:
+            for fname in idle_fnames:
+                if fname in results and fname not in references:
+                    try:
+                        self.calibrations.save(self.analyzer, results[fname], self.calibration_params())
+                    except OSError as e:
+                        self.errors[fname] = e
+        results.update(references)
+        shift_maps = {}
+        for idle_fname in idle_fnames:
+            for active_fname in active_fnames:
+                if idle_fname not in results or active_fname not in results:
+                    continue
+                try:
+                    shift_maps[(idle_fname, active_fname)] = self.compare(results[idle_fname], results[active_fname])
+                except ValueError as e:
+                    self.errors[(idle_fname, active_fname)] = e
+        return results, shift_maps
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+
+def write_atomic(fname, write):
+    # Writes through a uniquely named temporary file in the same folder, so that readers never see a
+    # partial file and concurrent writers in the same process or in other processes don't collide
+    fd, tmp_fname = tempfile.mkstemp(dir=os.path.dirname(fname) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+
+class FileHashes:
+    def __init__(self, fname=None):
+        # Content hashes are remembered per path, size and mtime so unchanged files are only read
+        # once. With fname they are kept in that JSON file across restarts, otherwise in memory.
+        self.fname = fname
+        self.hashes = {}
+
+    def load(self):
+        if self.fname is None:
+            return self.hashes
+        try:
+            with open(self.fname, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def file_hash(self, path):
+        path_stat = os.stat(path)
+        hashes = self.load()
+        entry = hashes.get(os.path.abspath(path))
+        if entry is not None and entry[:2] == [path_stat.st_mtime_ns, path_stat.st_size]:
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        hashes[os.path.abspath(path)] = [path_stat.st_mtime_ns, path_stat.st_size, digest.hexdigest()]
+        if self.fname is not None:
+            write_atomic(self.fname, lambda f: f.write(json.dumps(hashes).encode()))
+        return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=4 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hashes = FileHashes(os.path.join(cache_dir, "file_hashes.json"))
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def file_hash(self, path):
+        return self.hashes.file_hash(path)
+
+    def input_key(self, fname):
+        return self.key(None, "input", npy=self.file_hash(f"{fname}.npy"), yaml=self.file_hash(f"{fname}.yaml"))
+
+    def key(self, parent_key, stage, **params):
+        # A stage is identified by its upstream key and its own parameters, so changing a
+        # parameter only invalidates that stage and the ones after it
+        description = json.dumps([parent_key, stage, params], sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def entry_fname(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        entry_fname = self.entry_fname(key)
+        try:
+            with np.load(entry_fname) as entry:
+                arrays = {name: entry[name] for name in entry.files}
+        except (OSError, ValueError):
+            return None
+        # The modification time doubles as the last access time for LRU eviction
+        os.utime(entry_fname)
+        return arrays
+
+    def put(self, key, arrays):
+        entry_fname = self.entry_fname(key)
+        os.makedirs(os.path.dirname(entry_fname), exist_ok=True)
+        write_atomic(entry_fname, lambda f: np.savez(f, **arrays))
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(".npz"):
+                    entry_stat = entry.stat()
+                    entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import numpy as np
+from peakanalyzer.batch import AcquisitionResult
+from peakanalyzer.cache import write_atomic
+
+# Bump whenever the contents or the meaning of the stored arrays change
+CALIBRATION_VERSION = 1
+
+
+def source_key(fname):
+    # Identifies the acquisition a calibration was built from without reading it
+    npy_stat, yaml_stat = os.stat(f"{fname}.npy"), os.stat(f"{fname}.yaml")
+    return np.array([npy_stat.st_mtime_ns, npy_stat.st_size, yaml_stat.st_mtime_ns, yaml_stat.st_size],
+                    dtype=np.int64)
+
+
+class ReferenceCalibration:
+    def __init__(self, fname, params, source, frq, step_intervals, peaks, peak_frequencies, deltas, popt=None,
+                 refined_peaks=None):
+        self.fname = fname
+        # Processing parameters the reference was analysed with, and the file it was built from
+        self.params = params
+        self.source = source
+        self.frq = frq
+        self.step_intervals = step_intervals
+        # Peak indices (18, row, col), their frequencies, splitting deltas (3, row, col) and, when
+        # the reference was fitted, the Lorentzian parameters (54, row, col)
+        self.peaks = peaks
+        self.peak_frequencies = peak_frequencies
+        self.deltas = deltas
+        self.popt = popt
+        self.refined_peaks = refined_peaks
+
+    @classmethod
+    def from_result(cls, analyzer, result, params):
+        peaks = result.peaks if result.refined_peaks is None else result.refined_peaks
+        return cls(result.fname, params, source_key(result.fname), result.frq, result.step_intervals, result.peaks,
+                   analyzer.get_peak_frequencies(peaks, result.frq), result.deltas, result.popt,
+                   result.refined_peaks)
+
+    def to_result(self):
+        # The smoothed spectra are not part of the calibration
+        return AcquisitionResult(self.fname, self.frq, None, self.step_intervals, self.peaks, self.deltas, self.popt,
+                                 self.refined_peaks)
+
+    def save(self, path):
+        arrays = {"version": np.array(CALIBRATION_VERSION), "fname": np.array(self.fname),
+                  "params": np.array(json.dumps(self.params, sort_keys=True)), "source": self.source,
+                  "frq": self.frq, "step_intervals": self.step_intervals, "peaks": self.peaks,
+                  "peak_frequencies": self.peak_frequencies, "deltas": self.deltas}
+        if self.popt is not None:
+            arrays["popt"] = self.popt
+        if self.refined_peaks is not None:
+            arrays["refined_peaks"] = self.refined_peaks
+        write_atomic(path, lambda f: np.savez(f, **arrays))
+
+    @classmethod
+    def load(cls, path, params=None, source=None, fname=None):
+        # Rejects calibrations written by another version, built with other processing parameters,
+        # for another reference file or from a reference file that has changed since
+        with np.load(path) as artifact:
+            if int(artifact["version"]) != CALIBRATION_VERSION:
+                raise ValueError(f"Calibration {path} has version {int(artifact['version'])}, "
+                                 f"expected {CALIBRATION_VERSION}")
+            if fname is not None and os.path.abspath(str(artifact["fname"])) != os.path.abspath(fname):
+                raise ValueError(f"Calibration {path} was built for {artifact['fname']}, not {fname}")
+            stored_params = json.loads(str(artifact["params"]))
+            if params is not None and stored_params != json.loads(json.dumps(params, sort_keys=True)):
+                raise ValueError(f"Calibration {path} was built with different processing parameters")
+            if source is not None and not np.array_equal(artifact["source"], source):
+                raise ValueError(f"Calibration {path} was built from a different reference file")
+            arrays = {name: artifact[name] for name in artifact.files}
+        return cls(str(arrays["fname"]), stored_params, arrays["source"], arrays["frq"], arrays["step_intervals"],
+                   arrays["peaks"], arrays["peak_frequencies"], arrays["deltas"], arrays.get("popt"),
+                   arrays.get("refined_peaks"))
+
+
+class CalibrationStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, fname):
+        # References with the same name in different folders get different artifacts
+        path_hash = hashlib.sha256(os.path.abspath(fname).encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{os.path.basename(fname)}.{path_hash}.calibration.npz")
+
+    def load(self, fname, params):
+        # The reference result, or None when there is no calibration that is still valid for it
+        try:
+            return ReferenceCalibration.load(self.path(fname), params, source_key(fname), fname).to_result()
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, analyzer, result, params):
+        ReferenceCalibration.from_result(analyzer, result, params).save(self.path(result.fname))
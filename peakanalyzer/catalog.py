@@ -0,0 +1,160 @@
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+ROLE_SUBDIRS = {"idle": "without_current/", "active": "with_current/"}
+# e.g. ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50
+FNAME_PATTERN = re.compile(r"^(?P<kind>.+?)_(?P<acquired_at>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})_"
+                           r"(?P<sample>[^_]+)_(?P<label>.+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS acquisitions (
+    fname TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    role TEXT NOT NULL,
+    sample TEXT,
+    label TEXT,
+    acquired_at TEXT,
+    shape TEXT,
+    dtype TEXT,
+    frequency_min REAL,
+    frequency_max REAL,
+    num_frequencies INTEGER,
+    step_intervals TEXT,
+    npy_mtime_ns INTEGER,
+    npy_size INTEGER,
+    yaml_mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS acquisitions_lookup ON acquisitions (role, sample, acquired_at);
+CREATE TABLE IF NOT EXISTS folders (
+    folder TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+
+def read_npy_header(path):
+    # Shape and dtype straight from the .npy header, without reading or mapping the data
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype
+
+
+def parse_fname(name):
+    match = FNAME_PATTERN.match(name)
+    if match is None:
+        return None, None, None
+    acquired_at = datetime.strptime(match["acquired_at"], "%Y-%m-%d-%H-%M-%S")
+    return match["sample"], match["label"], acquired_at.isoformat()
+
+
+class AcquisitionCatalog:
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def update(self, datafolder, analyzer, force=False):
+        # Only folders whose mtime changed (files added, removed or renamed) are rescanned, and
+        # within them only new or modified acquisitions are parsed. force rescans every folder
+        # to also pick up files rewritten in place.
+        for subdir in ROLE_SUBDIRS.values():
+            if not os.path.isdir(datafolder + subdir):
+                raise ValueError("The specified directory does not exist.")
+        with self.connect() as conn:
+            for role, subdir in ROLE_SUBDIRS.items():
+                folder = datafolder + subdir
+                row = conn.execute("SELECT mtime_ns FROM folders WHERE folder = ?", (folder,)).fetchone()
+                # Taken before the scan, so acquisitions written during it are picked up next time.
+                # Metadata sidecars written by the scan cost one extra rescan.
+                mtime_ns = os.stat(folder).st_mtime_ns
+                if not force and row is not None and row[0] == mtime_ns:
+                    continue
+                self.update_folder(conn, folder, role, analyzer)
+                conn.execute("INSERT OR REPLACE INTO folders (folder, mtime_ns) VALUES (?, ?)", (folder, mtime_ns))
+
+    def update_folder(self, conn, folder, role, analyzer):
+        known = {fname: (npy_mtime_ns, npy_size, yaml_mtime_ns) for fname, npy_mtime_ns, npy_size, yaml_mtime_ns in
+                 conn.execute("SELECT fname, npy_mtime_ns, npy_size, yaml_mtime_ns FROM acquisitions "
+                              "WHERE folder = ?", (folder,))}
+        present = set()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".npy") or not entry.is_file():
+                    continue
+                fname = folder + entry.name.split(".npy")[0]
+                present.add(fname)
+                npy_stat = entry.stat()
+                yaml_path = f"{fname}.yaml"
+                yaml_mtime_ns = os.stat(yaml_path).st_mtime_ns if os.path.isfile(yaml_path) else None
+                if known.get(fname) == (npy_stat.st_mtime_ns, npy_stat.st_size, yaml_mtime_ns):
+                    continue
+                self.add(conn, fname, folder, role, npy_stat, yaml_mtime_ns, analyzer)
+        removed = [(fname,) for fname in known if fname not in present]
+        conn.executemany("DELETE FROM acquisitions WHERE fname = ?", removed)
+
+    def add(self, conn, fname, folder, role, npy_stat, yaml_mtime_ns, analyzer):
+        sample, label, acquired_at = parse_fname(os.path.basename(fname))
+        if acquired_at is None:
+            acquired_at = datetime.fromtimestamp(npy_stat.st_mtime).isoformat()
+        shape, dtype = read_npy_header(f"{fname}.npy")
+        frequency_min = frequency_max = num_frequencies = step_intervals = None
+        if yaml_mtime_ns is not None:
+            frq, intervals = analyzer.load_metadata(fname)
+            frequency_min, frequency_max, num_frequencies = float(np.min(frq)), float(np.max(frq)), len(frq)
+            step_intervals = json.dumps(np.asarray(intervals).tolist())
+        conn.execute("INSERT OR REPLACE INTO acquisitions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (fname, folder, role, sample, label, acquired_at, json.dumps(shape), dtype.str,
+                      frequency_min, frequency_max, num_frequencies, step_intervals,
+                      npy_stat.st_mtime_ns, npy_stat.st_size, yaml_mtime_ns))
+
+    def query(self, role=None, sample=None, since=None, until=None, datafolder=None):
+        conditions, values = [], []
+        if role is not None:
+            conditions.append("role = ?")
+            values.append(role)
+        if sample is not None:
+            conditions.append("sample = ?")
+            values.append(sample)
+        if since is not None:
+            conditions.append("acquired_at >= ?")
+            values.append(since.isoformat() if isinstance(since, datetime) else since)
+        if until is not None:
+            conditions.append("acquired_at < ?")
+            values.append(until.isoformat() if isinstance(until, datetime) else until)
+        if datafolder is not None:
+            conditions.append("folder IN (?, ?)")
+            values.extend(datafolder + subdir for subdir in ROLE_SUBDIRS.values())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.connect() as conn:
+            rows = conn.execute(f"SELECT fname FROM acquisitions{where} ORDER BY acquired_at, fname", values)
+            return [fname for fname, in rows]
+
+    def get(self, fname):
+        with self.connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM acquisitions WHERE fname = ?", (fname,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["shape"] = tuple(json.loads(entry["shape"]))
+        if entry["step_intervals"] is not None:
+            entry["step_intervals"] = json.loads(entry["step_intervals"])
+        return entry
@@ -0,0 +1,114 @@
+import csv
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+FIELDS = ["stage", "calls", "failures", "total_time", "mean_time", "max_time", "items", "bytes", "nfev"]
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.stages = {}
+
+    def get_stage(self, stage):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = {"calls": 0, "failures": 0, "total_time": 0.0, "max_time": 0.0,
+                                          "items": 0, "bytes": 0, "nfev": 0}
+        return stats
+
+    def record(self, stage, elapsed, items=0, nbytes=0, nfev=0, failed=False):
+        # failed counts calls that raised, they are included in the calls and times
+        if not self.enabled:
+            return
+        stats = self.get_stage(stage)
+        stats["calls"] += 1
+        stats["failures"] += failed
+        stats["total_time"] += elapsed
+        stats["max_time"] = max(stats["max_time"], elapsed)
+        stats["items"] += items
+        stats["bytes"] += nbytes
+        stats["nfev"] += nfev
+
+    @contextmanager
+    def timer(self, stage, data=None):
+        # The body may fill in extra counters, e.g. measurement["nfev"] for fits. A body that raises
+        # is recorded as a failure.
+        measurement = {}
+        failed = True
+        start_time = time.perf_counter()
+        try:
+            yield measurement
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.record(stage, elapsed, getattr(data, "size", 0), getattr(data, "nbytes", 0),
+                        measurement.get("nfev", 0), failed)
+
+    def merge(self, stages):
+        # Adds the stages recorded by another Metrics, e.g. one returned from a worker process
+        if not self.enabled:
+            return
+        for stage, stats in stages.items():
+            merged = self.get_stage(stage)
+            for key in ("calls", "failures", "total_time", "items", "bytes", "nfev"):
+                merged[key] += stats[key]
+            merged["max_time"] = max(merged["max_time"], stats["max_time"])
+
+    def reset(self):
+        self.started_at = time.time()
+        self.stages = {}
+
+    def rows(self):
+        return [{"stage": stage, "mean_time": stats["total_time"] / stats["calls"], **stats}
+                for stage, stats in self.stages.items()]
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"started_at": self.started_at, "stages": self.rows()}, f, indent=2)
+
+    def to_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows())
+
+    def export(self, path):
+        if path.endswith(".csv"):
+            self.to_csv(path)
+        else:
+            self.to_json(path)
+
+    def summary(self):
+        return "\n".join(f"{row['stage']:>24}: {row['calls']:>6} calls {row['total_time']:>10.4f} s total "
+                         f"{row['mean_time'] * 1e3:>10.3f} ms mean {row['failures']:>6} failed"
+                         for row in self.rows())
+
+
+def instrumented(stage, result_index=None):
+    # Records wall time and call count of a PeakAnalyzer method in self.metrics, together with the
+    # size of its first argument or, for loaders, of the result at result_index. Calls that raise
+    # are recorded as failures.
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            if not metrics.enabled:
+                return method(self, *args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                result = method(self, *args, **kwargs)
+            except Exception:
+                data = None if result_index is not None else (args[0] if args else None)
+                metrics.record(stage, time.perf_counter() - start_time, getattr(data, "size", 0),
+                               getattr(data, "nbytes", 0), failed=True)
+                raise
+            elapsed = time.perf_counter() - start_time
+            data = result[result_index] if result_index is not None else (args[0] if args else None)
+            metrics.record(stage, elapsed, getattr(data, "size", 0), getattr(data, "nbytes", 0))
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,87 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+# Per worker process state, filled in once by the pool initializer
+_worker_state = {}
+
+
+class SharedArray:
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self.shm.buf)
+        self.array[...] = array
+
+    @property
+    def spec(self):
+        # Small picklable handle that workers use to attach to the same buffer
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach_shared_array(spec):
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def split_range(count, num_shards):
+    if count <= 0:
+        return []
+    bounds = np.linspace(0, count, min(num_shards, count) + 1).astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _init_fit_worker(analyzer, frq, data_spec, peaks, step_intervals, depth, warm_start_shape):
+    _worker_state.update(analyzer=analyzer, frq=frq, data_spec=data_spec, peaks=peaks,
+                         step_intervals=step_intervals, depth=depth, warm_start_shape=warm_start_shape)
+
+
+def _fit_pixel_range(pixels):
+    state = _worker_state
+    analyzer = state["analyzer"]
+    analyzer.metrics.reset()
+    # The buffer is attached for this shard only, so long lived workers do not accumulate mappings
+    shm, data = attach_shared_array(state["data_spec"])
+    try:
+        popt = analyzer.curve_fitting_pixels(state["frq"], data, state["peaks"], pixels,
+                                             step_intervals=state["step_intervals"], depth=state["depth"],
+                                             warm_start_shape=state["warm_start_shape"])
+    finally:
+        del data
+        shm.close()
+    return popt, analyzer.metrics.stages
+
+
+def fit_pixels_parallel(analyzer, frq, data, peaks, step_intervals=None, depth=200000, workers=None,
+                        shards_per_worker=4, warm_start_shape=None):
+    # data is (frequency, pixel). It is placed in shared memory once instead of being pickled
+    # to every worker; pixels are sharded into contiguous ranges and the results are
+    # concatenated in shard order, so the output does not depend on scheduling. Warm started
+    # fits are sharded into bands of whole rows, each traversed in serpentine order, so every
+    # shard is a spatially coherent region.
+    if workers is None or workers < 1:
+        raise ValueError("No. of workers must be positive")
+    if warm_start_shape is None:
+        shards = [np.arange(start, end) for start, end in split_range(data.shape[1], workers * shards_per_worker)]
+    else:
+        shards = [analyzer.serpentine_pixels(warm_start_shape, rows)
+                  for rows in split_range(warm_start_shape[0], workers * shards_per_worker)]
+    with SharedArray(data) as shared_data:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_fit_worker,
+                                 initargs=(analyzer, frq, shared_data.spec, peaks, step_intervals, depth,
+                                           warm_start_shape)) as executor:
+            results = list(executor.map(_fit_pixel_range, shards))
+    for _, stages in results:
+        analyzer.metrics.merge(stages)
+    popt = np.empty((data.shape[1], 18 * 3))
+    popt[np.concatenate(shards)] = np.concatenate([shard_popt for shard_popt, _ in results])
+    return popt
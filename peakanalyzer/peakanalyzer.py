@@ -1,34 +1,73 @@
 import os
 import numpy as np
 import yaml
-from scipy.signal import savgol_filter, find_peaks
-from scipy.optimize import curve_fit
-from esr import linep2dp
-import matplotlib.pyplot as plt
+from peakanalyzer.cache import write_atomic
+from peakanalyzer.metrics import Metrics, instrumented
+from peakanalyzer.render import Renderer, decimate_trace, draw_image, draw_peaks
 
 class PeakAnalyzer:
-    def __init__(self, datafolder):
-        self.idle_waves_fnames, self.active_waves_fnames = self.load_fnames(datafolder)
-    def smooth_data(self, data, window_length=15, poly_order=3):
+    def __init__(self, datafolder, metrics=None, renderer=None, catalog=None):
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.renderer = renderer if renderer is not None else Renderer()
+        self._metadata_cache = {}
+        if catalog is not None:
+            self.idle_waves_fnames, self.active_waves_fnames = self.load_fnames_from_catalog(datafolder, catalog)
+        else:
+            self.idle_waves_fnames, self.active_waves_fnames = self.load_fnames(datafolder)
+    @instrumented("smooth_data")
+    def smooth_data(self, data, window_length=15, poly_order=3, axis=-1):
         if len(data) <= 0:
             raise ValueError("Provided data for data smoothing is empty")
-        return savgol_filter(data, window_length, poly_order)
+        # scipy is imported on first use, importing it costs more than a second and pulls in
+        # scipy.optimize, which processes that never fit do not need
+        from scipy.signal import savgol_filter
+        return savgol_filter(data, window_length, poly_order, axis=axis)
     def lorentzian(self, x, amp, cen, wid):
         return -amp * wid ** 2 / ((x - cen) ** 2 + wid ** 2)
 
+    def multi_lorentzian(self, x, *params):
+        if len(params) % 3 != 0:
+            raise ValueError("No. of params for multi lorentzian is incorrect")
+        amp, cen, wid = np.reshape(params, (-1, 3)).T[:, :, None]
+        return np.sum(self.lorentzian(np.asarray(x), amp, cen, wid), axis=0)
+
+    def multi_lorentzian_jacobian(self, x, *params):
+        if len(params) % 3 != 0:
+            raise ValueError("No. of params for multi lorentzian is incorrect")
+        amp, cen, wid = np.reshape(params, (-1, 3)).T
+        offset = np.asarray(x)[:, None] - cen
+        denominator = offset ** 2 + wid ** 2
+        profile = wid ** 2 / denominator
+        jacobian = np.empty((len(offset), len(params)))
+        jacobian[:, 0::3] = -profile
+        jacobian[:, 1::3] = -2 * amp * profile * offset / denominator
+        jacobian[:, 2::3] = -2 * amp * wid * offset ** 2 / denominator ** 2
+        return jacobian
+
     def fit_all_clusters(self, x, *params):
         if len(params) != 18*3:
             raise ValueError("No. of params for curve fitting is incorrect")
-        result = np.zeros_like(x)
-        for i in range(0, len(params), 3):
-            amp, cen, wid = params[i:i + 3]
-            result += self.lorentzian(x, amp, cen, wid)
-        return result
+        return self.multi_lorentzian(x, *params)
+
+    def fit_all_clusters_jacobian(self, x, *params):
+        if len(params) != 18*3:
+            raise ValueError("No. of params for curve fitting is incorrect")
+        return self.multi_lorentzian_jacobian(x, *params)
+
+    def fit_cluster(self, x, *params):
+        if len(params) != 3*3:
+            raise ValueError("No. of params for cluster fitting is incorrect")
+        return self.multi_lorentzian(x, *params)
+
+    def fit_cluster_jacobian(self, x, *params):
+        if len(params) != 3*3:
+            raise ValueError("No. of params for cluster fitting is incorrect")
+        return self.multi_lorentzian_jacobian(x, *params)
 
     def visualize_data(self, x, y, title='', xaxis_title='X-axis', yaxis_title='Y-axis',
                             line_color='royalblue'):
-        linep2dp(
-                [f * 1e-9 for f in x],
+        self.renderer.render_line(
+                np.asarray(x) * 1e-9,
                 y,
                 title=title,
                 xaxis_title=xaxis_title,
@@ -36,15 +75,12 @@ class PeakAnalyzer:
                 color=line_color
             )
     def visualise_peaks(self, x, y, peaks, title="", color="blue"):
-        plt.figure(figsize=(10, 5))
-        plt.plot([f * 1e-9 for f in x], y, label='Smoothed Clipped Data', color=color)
-        plt.scatter([f * 1e-9 for f in x[peaks]], y[peaks], color='red', s=50, label='Detected Peaks', zorder=2.5)
-        plt.title(title)
-        plt.xlabel('Frequency GHz')
-        plt.ylabel('Normalized Intensity')
-        plt.legend()
-        plt.grid(True)
-        plt.show()
+        if self.renderer.mode == "off":
+            return
+        x, y = np.asarray(x), np.asarray(y)
+        line_x, line_y = decimate_trace(x, y, self.renderer.max_points)
+        self.renderer.render(draw_peaks, (10, 5), line_x.copy(), line_y.copy(), x[peaks], y[peaks],
+                             title=title, color=color)
     def chunk_array_by_sizes(self, data, chunk_sizes):
         chunks = []
         start_index = 0
@@ -59,25 +95,180 @@ class PeakAnalyzer:
         return chunks
 
     def generate_parameters_for_fitting(self, x, y, peaks):
+        # y has its baseline removed, so the depth of a dip is the (positive) amplitude of the
+        # inverted Lorentzian. The width starts at half the spacing of the dips of a cluster.
         parameter_list = []
         for index in range(0, len(peaks), 3):
-            width = (x[peaks[index + 2]] - x[peaks[index]]) / 2
-            peak_1 = [y[peaks[index]], x[peaks[index]], width]
-            peak_2 = [y[peaks[index + 1]], x[peaks[index + 1]], width]
-            peak_3 = [y[peaks[index + 2]], x[peaks[index + 2]], width]
+            width = (x[peaks[index + 2]] - x[peaks[index]]) / 4
+            peak_1 = [-y[peaks[index]], x[peaks[index]], width]
+            peak_2 = [-y[peaks[index + 1]], x[peaks[index + 1]], width]
+            peak_3 = [-y[peaks[index + 2]], x[peaks[index + 2]], width]
             parameter_list.extend(peak_1)
             parameter_list.extend(peak_2)
             parameter_list.extend(peak_3)
         return parameter_list
 
-    def curve_fitting(self, x, y, peaks, depth=200000):
+    def remove_baseline(self, y):
+        # The model has no offset, the dips only cover a small part of the spectrum so its median
+        # is the level they are measured from
+        return y - np.median(y)
+
+    def curve_fitting(self, x, y, peaks, depth=200000, analytic_jacobian=True, initial_guesses=None):
         if len(peaks) != 18:
             raise ValueError("No. of peaks for curve fitting is incorrect")
-        initial_guesses = self.generate_parameters_for_fitting(x, y, peaks)
-        popt, pcov = curve_fit(self.fit_all_clusters, x, y, p0=initial_guesses,
-                               maxfev=depth)
+        y = self.remove_baseline(y)
+        if initial_guesses is None:
+            initial_guesses = self.generate_parameters_for_fitting(x, y, peaks)
+        from scipy.optimize import curve_fit
+        jacobian = self.fit_all_clusters_jacobian if analytic_jacobian else None
+        with self.metrics.timer("curve_fitting", y) as measurement:
+            popt, pcov, infodict, _, _ = curve_fit(self.fit_all_clusters, x, y, p0=initial_guesses,
+                                                   jac=jacobian, maxfev=depth, full_output=True)
+            measurement["nfev"] = infodict["nfev"]
+        return popt, pcov
+
+    def curve_fitting_cluster(self, x, y, peaks, depth=200000, initial_guesses=None):
+        if len(peaks) != 3:
+            raise ValueError("No. of peaks for cluster fitting is incorrect")
+        if np.any(np.asarray(peaks) < 0):
+            # A cluster without three dips cannot be fitted, flag it without failing the spectrum
+            return np.full(9, np.nan), np.full((9, 9), np.inf)
+        if initial_guesses is None:
+            initial_guesses = self.generate_parameters_for_fitting(x, y, peaks)
+        from scipy.optimize import curve_fit
+        try:
+            with self.metrics.timer("curve_fitting_cluster", y) as measurement:
+                popt, pcov, infodict, _, _ = curve_fit(self.fit_cluster, x, y, p0=initial_guesses,
+                                                       jac=self.fit_cluster_jacobian, maxfev=depth, full_output=True)
+                measurement["nfev"] = infodict["nfev"]
+        except RuntimeError:
+            # Fit did not converge within depth, flag this cluster only so that it is not polished
+            popt, pcov = np.full(9, np.nan), np.full((9, 9), np.inf)
+        return popt, pcov
+
+    def curve_fitting_by_cluster(self, x, y, peaks, step_intervals, depth=200000, polish=False, workers=None,
+                                 initial_guesses=None):
+        if len(peaks) != 18 or len(step_intervals) != 6:
+            raise ValueError("No. of peaks for curve fitting is incorrect")
+        y = self.remove_baseline(y)
+        cluster_x = self.chunk_array_by_sizes(x, step_intervals)
+        cluster_y = self.chunk_array_by_sizes(y, step_intervals)
+        chunk_starts = np.cumsum(step_intervals) - step_intervals
+        cluster_peaks = [np.asarray(peaks[i:i + 3]) - np.where(np.asarray(peaks[i:i + 3]) >= 0, start, 0)
+                         for i, start in zip(range(0, 18, 3), chunk_starts)]
+        depths = [depth] * len(cluster_peaks)
+        if initial_guesses is None:
+            cluster_guesses = [None] * len(cluster_peaks)
+        else:
+            cluster_guesses = np.reshape(initial_guesses, (len(cluster_peaks), 9))
+        if workers is not None and workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(self.curve_fitting_cluster, cluster_x, cluster_y, cluster_peaks, depths,
+                                            cluster_guesses))
+        else:
+            results = list(map(self.curve_fitting_cluster, cluster_x, cluster_y, cluster_peaks, depths,
+                               cluster_guesses))
+
+        popt = np.concatenate([cluster_popt for cluster_popt, _ in results])
+        pcov = np.zeros((len(popt), len(popt)))
+        for i, (_, cluster_pcov) in enumerate(results):
+            pcov[i * 9:(i + 1) * 9, i * 9:(i + 1) * 9] = cluster_pcov
+        if polish and np.all(np.isfinite(popt)):
+            # Joint refinement of all 18 dips starting from the per-cluster solution
+            from scipy.optimize import curve_fit
+            with self.metrics.timer("curve_fitting_polish", y) as measurement:
+                popt, pcov, infodict, _, _ = curve_fit(self.fit_all_clusters, x, y, p0=popt,
+                                                       jac=self.fit_all_clusters_jacobian, maxfev=depth,
+                                                       full_output=True)
+                measurement["nfev"] = infodict["nfev"]
         return popt, pcov
 
+    def fit_spectrum(self, x, y, peaks, step_intervals=None, depth=200000, initial_guesses=None):
+        # Fits always run in double precision, also on reduced precision cubes
+        y = np.asarray(y, dtype=np.float64)
+        try:
+            if step_intervals is None:
+                return self.curve_fitting(x, y, peaks, depth=depth, initial_guesses=initial_guesses)
+            return self.curve_fitting_by_cluster(x, y, peaks, step_intervals, depth=depth,
+                                                 initial_guesses=initial_guesses)
+        except RuntimeError:
+            return None, None
+
+    def fit_diverged(self, x, popt, pcov):
+        # A fit that failed, has no covariance estimate or moved a dip off the frequency axis
+        if popt is None or not np.all(np.isfinite(popt)) or not np.all(np.isfinite(np.diag(pcov))):
+            return True
+        centres = popt[1::3]
+        return bool(np.any((centres < np.min(x)) | (centres > np.max(x))))
+
+    def serpentine_pixels(self, spatial_shape, rows=None):
+        # Flat indices of the pixels of rows [start, end), row by row in alternating direction so
+        # that consecutive pixels are always neighbours
+        height, width = spatial_shape
+        start, end = (0, height) if rows is None else rows
+        order = np.arange(start * width, end * width).reshape(end - start, width)
+        order[1::2] = order[1::2, ::-1]
+        return order.ravel()
+
+    def neighbour_seed(self, converged, pixel, spatial_shape):
+        # Mean of the converged parameters of the 4-connected neighbours fitted so far
+        height, width = spatial_shape
+        row, col = divmod(pixel, width)
+        neighbours = [pixel + offset for offset, valid in ((-1, col > 0), (1, col < width - 1),
+                                                           (-width, row > 0), (width, row < height - 1)) if valid]
+        seeds = [converged[neighbour] for neighbour in neighbours if neighbour in converged]
+        return np.mean(seeds, axis=0) if seeds else None
+
+    def curve_fitting_pixels(self, frq, data, peaks, pixels, step_intervals=None, depth=200000, warm_start_shape=None):
+        # data is (frequency, pixel) and peaks is (18, pixel), pixels that cannot be fitted stay NaN.
+        # With warm_start_shape (row, col) of the image, every fit is seeded with the parameters of
+        # its already converged neighbours, falling back to the guesses from the detected dips when
+        # there are none or the seeded fit diverges.
+        popt_list = np.full((len(pixels), 18 * 3), np.nan)
+        converged = {}
+        for i, pixel in enumerate(pixels):
+            if np.any(peaks[:, pixel] < 0):
+                continue
+            seed = None if warm_start_shape is None else self.neighbour_seed(converged, pixel, warm_start_shape)
+            popt = None
+            if seed is not None:
+                popt, pcov = self.fit_spectrum(frq, data[:, pixel], peaks[:, pixel], step_intervals, depth, seed)
+                if self.fit_diverged(frq, popt, pcov):
+                    self.metrics.record("warm_start_fallback", 0.0)
+                    popt = None
+            if popt is None:
+                popt, pcov = self.fit_spectrum(frq, data[:, pixel], peaks[:, pixel], step_intervals, depth)
+            if popt is None:
+                continue
+            popt_list[i] = popt
+            if warm_start_shape is not None and not self.fit_diverged(frq, popt, pcov):
+                converged[pixel] = popt
+        return popt_list
+
+    @instrumented("curve_fitting_image")
+    def curve_fitting_image(self, frq, data, peaks, step_intervals=None, depth=200000, workers=None,
+                            warm_start=False):
+        # Fits every pixel of a (frequency, row, col) cube, per cluster when step_intervals are given,
+        # and returns the fitted parameters as (54, row, col) maps. warm_start traverses the image in
+        # serpentine order and seeds every fit from its fitted neighbours.
+        spatial_shape = data.shape[1:]
+        if warm_start and len(spatial_shape) > 2:
+            raise ValueError("Warm started fitting needs a (frequency, row, col) or (frequency, pixel) cube")
+        warm_start_shape = ((1,) * (2 - len(spatial_shape)) + spatial_shape) if warm_start else None
+        data = data.reshape(len(data), -1)
+        peaks = peaks.reshape(len(peaks), -1)
+        if workers is not None and workers > 1:
+            from peakanalyzer.parallel import fit_pixels_parallel
+            popt = fit_pixels_parallel(self, frq, data, peaks, step_intervals=step_intervals, depth=depth,
+                                       workers=workers, warm_start_shape=warm_start_shape)
+        else:
+            pixels = np.arange(data.shape[1]) if warm_start_shape is None else self.serpentine_pixels(warm_start_shape)
+            popt = np.empty((data.shape[1], 18 * 3))
+            popt[pixels] = self.curve_fitting_pixels(frq, data, peaks, pixels, step_intervals=step_intervals,
+                                                     depth=depth, warm_start_shape=warm_start_shape)
+        return popt.T.reshape(len(popt.T), *spatial_shape)
+
     def get_clip_range(self, step_interval_list, clip_percentage=.10):
         if len(step_interval_list) <= 0:
             raise ValueError("Step interval list is empty")
@@ -87,12 +278,33 @@ class PeakAnalyzer:
         delta_list = []
         if len(peaks) != 18:
             raise ValueError("No. of peaks for peak delta is incorrect")
-        delta_one_six_peak = np.abs((np.sum(frq[peaks[0:3]]) / 3) - (np.sum(frq[peaks[15:18]]) / 3))
-        delta_two_five_peak = np.abs((np.sum(frq[peaks[3:6]]) / 3) - (np.sum(frq[peaks[12:15]]) / 3))
-        delta_three_four_peak = np.abs((np.sum(frq[peaks[6:9]]) / 3) - (np.sum(frq[peaks[9:12]]) / 3))
+        # Missing peaks (-1) turn the affected deltas into NaN
+        peak_frq = self.get_peak_frequencies(peaks, frq)
+        delta_one_six_peak = np.abs((np.sum(peak_frq[0:3]) / 3) - (np.sum(peak_frq[15:18]) / 3))
+        delta_two_five_peak = np.abs((np.sum(peak_frq[3:6]) / 3) - (np.sum(peak_frq[12:15]) / 3))
+        delta_three_four_peak = np.abs((np.sum(peak_frq[6:9]) / 3) - (np.sum(peak_frq[9:12]) / 3))
         delta_list.extend([delta_one_six_peak, delta_two_five_peak, delta_three_four_peak])
         return delta_list
 
+    def get_peak_frequencies(self, peaks, frq):
+        # Missing peaks are marked with -1 and get a NaN frequency, fractional (refined) peak
+        # indices are interpolated on the frequency axis
+        peaks, frq = np.asarray(peaks), np.asarray(frq)
+        if np.issubdtype(peaks.dtype, np.floating):
+            return np.where(peaks >= 0, np.interp(peaks, np.arange(len(frq)), frq), np.nan)
+        return np.where(peaks >= 0, frq[np.maximum(peaks, 0)], np.nan)
+
+    def get_peaks_delta_batch(self, peaks, frq):
+        if len(peaks) != 18:
+            raise ValueError("No. of peaks for peak delta is incorrect")
+        # Missing peaks turn the affected deltas into NaN
+        peak_frq = self.get_peak_frequencies(peaks, frq)
+        cluster_frq = np.sum(peak_frq.reshape(6, 3, *peaks.shape[1:]), axis=1) / 3
+        delta_one_six_peak = np.abs(cluster_frq[0] - cluster_frq[5])
+        delta_two_five_peak = np.abs(cluster_frq[1] - cluster_frq[4])
+        delta_three_four_peak = np.abs(cluster_frq[2] - cluster_frq[3])
+        return np.stack([delta_one_six_peak, delta_two_five_peak, delta_three_four_peak])
+
     def print_results(self, peaks_idle, frq_idle, peaks_active, frq_active):
         if len(peaks_idle) != 18 and len(peaks_active) !=18:
             raise ValueError("No. of peaks for calculation is incorrect")
@@ -113,32 +325,111 @@ class PeakAnalyzer:
         active_fname_list = [datafolder+subdir[1] +file.split(".npy")[0] for file in active_files if os.path.isfile(os.path.join(datafolder + subdir[1], file)) and file.endswith(".npy")]
         return idle_fname_list, active_fname_list
 
+    def load_fnames_from_catalog(self, datafolder, catalog):
+        # Only folders that changed since the last run are rescanned
+        catalog.update(datafolder, self)
+        return (catalog.query(role="idle", datafolder=datafolder),
+                catalog.query(role="active", datafolder=datafolder))
+
     def get_idle_fname_list(self):
         return self.idle_waves_fnames
 
     def get_active_fname_list(self):
         return self.active_waves_fnames
 
-    def load_data(self,filename):
-       y = np.load(f"{filename}.npy")
-       with open(f"{filename}.yaml","r") as f:
+    @instrumented("parse_metadata")
+    def parse_metadata(self, filename):
+        with open(f"{filename}.yaml", "r") as f:
             cfg = yaml.safe_load(f)
             frq = cfg["frequency_values"]
             step_intervals = cfg["step_intervals"]
-       return np.array(frq), y, np.array(step_intervals)
+        return np.array(frq), np.array(step_intervals)
+
+    def load_metadata(self, filename, use_sidecar=True):
+        if not use_sidecar:
+            return self.parse_metadata(filename)
+        # The sidecar is only valid for the YAML file it was built from
+        yaml_stat = os.stat(f"{filename}.yaml")
+        yaml_key = np.array([yaml_stat.st_mtime_ns, yaml_stat.st_size], dtype=np.int64)
+        cached = self._metadata_cache.get(filename)
+        if cached is None or not np.array_equal(cached[0], yaml_key):
+            cached = self.read_metadata_sidecar(filename, yaml_key)
+            if cached is None:
+                frq, step_intervals = self.parse_metadata(filename)
+                cached = (yaml_key, frq, step_intervals)
+                self.write_metadata_sidecar(filename, *cached)
+            self._metadata_cache[filename] = cached
+        # Callers are free to modify the returned arrays, e.g. when clipping step intervals
+        return cached[1].copy(), cached[2].copy()
+
+    @instrumented("read_metadata_sidecar")
+    def read_metadata_sidecar(self, filename, yaml_key):
+        try:
+            with np.load(f"{filename}.meta.npz") as sidecar:
+                if not np.array_equal(sidecar["yaml_key"], yaml_key):
+                    return None
+                return yaml_key, sidecar["frequency_values"], sidecar["step_intervals"]
+        except (OSError, KeyError, ValueError):
+            return None
+
+    @instrumented("write_metadata_sidecar")
+    def write_metadata_sidecar(self, filename, yaml_key, frq, step_intervals):
+        try:
+            write_atomic(f"{filename}.meta.npz", lambda f: np.savez(f, yaml_key=yaml_key, frequency_values=frq,
+                                                                    step_intervals=step_intervals))
+        except OSError:
+            # Read-only data folders still work, they just parse the YAML every time
+            pass
+
+    @instrumented("load_data", result_index=1)
+    def load_data(self,filename, mmap=False):
+       # With mmap the raw cube stays on disk and is paged in block by block by normalise_dataset
+       y = np.load(f"{filename}.npy", mmap_mode="r" if mmap else None)
+       frq, step_intervals = self.load_metadata(filename)
+       return frq, y, step_intervals
 
-    def normalise_dataset(self, data):
+    @instrumented("normalise_dataset")
+    def normalise_dataset(self, data, block_size=None, dtype=None):
+        # dtype (e.g. np.float32) is the precision the ratio is computed and summed in, by default
+        # that of the raw data
         if len(data) <= 0 or data.shape[0] < 2:
             raise ValueError("Provided data for data normalisation doesn't have the right dimensions")
-        return np.sum(data[0] / data[1], axis=1)
+        if block_size is None:
+            return np.sum(np.divide(data[0], data[1], dtype=dtype), axis=1)
+        if block_size <= 0:
+            raise ValueError("Block size for data normalisation must be positive")
+        # Stream over blocks of frequencies so that only one block of the raw cube and its ratio
+        # are held in memory. Every output value is reduced exactly as in the unblocked path.
+        num_frequencies = data.shape[1]
+        normalised = None
+        for start_index in range(0, num_frequencies, block_size):
+            end_index = min(start_index + block_size, num_frequencies)
+            block = np.sum(np.divide(data[0, start_index:end_index], data[1, start_index:end_index], dtype=dtype),
+                           axis=1)
+            if normalised is None:
+                normalised = np.empty((num_frequencies,) + block.shape[1:], dtype=block.dtype)
+            normalised[start_index:end_index] = block
+        return normalised
+
+    def bin_image(self, data, factor):
+        # Mean over factor x factor pixel blocks of a (frequency, row, col) cube, the blocks on the
+        # bottom and right edges are smaller when the image size is not a multiple of factor
+        if factor < 1:
+            raise ValueError("Binning factor must be positive")
+        row_starts, col_starts = np.arange(0, data.shape[1], factor), np.arange(0, data.shape[2], factor)
+        sums = np.add.reduceat(np.add.reduceat(data, row_starts, axis=1), col_starts, axis=2)
+        counts = np.outer(np.diff(row_starts, append=data.shape[1]), np.diff(col_starts, append=data.shape[2]))
+        return (sums / counts).astype(data.dtype, copy=False)
+
+    def expand_image(self, data, factor, spatial_shape):
+        # Inverse of bin_image for maps: every binned value is repeated over its block
+        expanded = np.repeat(np.repeat(data, factor, axis=-2), factor, axis=-1)
+        return expanded[..., :spatial_shape[0], :spatial_shape[1]]
 
     def plot_image(self, data, title, cmap="viridis"):
-        plt.figure(figsize=(8, 6))
-        plt.imshow(data, cmap=cmap, interpolation='nearest')  # Use 'gray' for grayscale image
-        plt.title(title)
-        plt.xlabel('Column Index')
-        plt.ylabel('Row Index')
-        plt.show()
+        if self.renderer.mode == "off":
+            return
+        self.renderer.render(draw_image, (8, 6), np.array(data), title=title, cmap=cmap)
 
     def print_data_statistics(self, data):
         print("Array Shape:", data.shape)
@@ -148,9 +439,96 @@ class PeakAnalyzer:
         print("Overall Standard Deviation In Dimension 2:", np.std(data[1]))
         self.plot_image(data[0, 0, 0, :, :], title=f"Single 50x50 image")
 
+    def clip_dataset(self, frq, data, step_intervals, clip_percentage=.10):
+        clip_range = self.get_clip_range(step_intervals, clip_percentage)
+        step_intervals = np.array(step_intervals)
+        step_intervals[0] -= clip_range
+        step_intervals[-1] -= clip_range
+        end_index = len(frq) - clip_range
+        return frq[clip_range:end_index], data[clip_range:end_index], step_intervals
+
+    def select_dips(self, data, num_peaks=3, distance=5):
+        # Vectorised equivalent of get_peaks followed by keeping the num_peaks deepest dips,
+        # applied to every column of a (frequency, spectra) array at once. Dips are selected
+        # greedily from the deepest one, suppressing neighbours closer than distance just
+        # like find_peaks does. Flat-bottomed (plateau) dips are not detected.
+        if len(data) <= 0:
+            raise ValueError("Provided data for peak finding is empty")
+        num_points, num_spectra = data.shape
+        columns = np.arange(num_spectra)
+        is_dip = np.zeros(data.shape, dtype=bool)
+        is_dip[1:-1] = (data[1:-1] < data[:-2]) & (data[1:-1] < data[2:])
+        heights = np.where(is_dip, data, np.inf)
+        dips = np.full((num_peaks, num_spectra), -1, dtype=np.intp)
+        for peak_index in range(num_peaks):
+            deepest = np.argmin(heights, axis=0)
+            found = np.isfinite(heights[deepest, columns])
+            dips[peak_index] = np.where(found, deepest, -1)
+            for offset in range(-distance + 1, distance):
+                neighbour = np.clip(deepest + offset, 0, num_points - 1)
+                heights[neighbour[found], columns[found]] = np.inf
+        return dips
+
+    @instrumented("get_peaks_batch")
+    def get_peaks_batch(self, data, step_intervals, num_peaks=3, distance=5):
+        if len(data) <= 0:
+            raise ValueError("Provided data for peak finding is empty")
+        spatial_shape = data.shape[1:]
+        data = data.reshape(len(data), -1)
+        peaks = np.full((len(step_intervals) * num_peaks, data.shape[1]), -1, dtype=np.intp)
+        start_step = 0
+        for chunk_index, chunk_data in enumerate(self.chunk_array_by_sizes(data, step_intervals)):
+            chunk_peaks = self.select_dips(chunk_data, num_peaks, distance)
+            chunk_peaks = np.where(chunk_peaks >= 0, chunk_peaks + start_step, -1)
+            # Sort peaks based on index i.e. get the right order of peaks
+            peaks[chunk_index * num_peaks:(chunk_index + 1) * num_peaks] = np.sort(chunk_peaks, axis=0)
+            start_step += len(chunk_data)
+        return peaks.reshape(len(peaks), *spatial_shape)
+
+    def refine_peaks(self, data, peaks, method="parabolic"):
+        # Sub-sample dip centres as fractional indices, from the vertex of the parabola through
+        # each dip and its two neighbours or from the centroid of their depths below the highest
+        # of the three. Dips on the first or last sample are kept as they are, missing ones as -1.
+        if method not in ("parabolic", "centroid"):
+            raise ValueError("Peak refinement method must be 'parabolic' or 'centroid'")
+        if len(data) < 3:
+            raise ValueError("Provided data for peak refinement is too short")
+        peaks = np.asarray(peaks)
+        peaks_shape = peaks.shape
+        data = data.reshape(len(data), -1)
+        peaks = peaks.reshape(len(peaks), -1)
+        columns = np.arange(data.shape[1])
+        centre = np.clip(peaks, 1, len(data) - 2)
+        left, middle, right = (data[centre + offset, columns].astype(float) for offset in (-1, 0, 1))
+        if method == "parabolic":
+            curvature = left - 2 * middle + right
+            shift = np.divide(0.5 * (left - right), curvature, out=np.zeros(curvature.shape), where=curvature > 0)
+        else:
+            top = np.maximum(np.maximum(left, middle), right)
+            depth = 3 * top - left - middle - right
+            shift = np.divide(left - right, depth, out=np.zeros(depth.shape), where=depth > 0)
+        refined = np.where(centre == peaks, peaks + np.clip(shift, -0.5, 0.5), peaks).astype(float)
+        return np.where(peaks >= 0, refined, -1.0).reshape(peaks_shape)
+
+    def analyse_dataset(self, frq, data, step_intervals, window_length=15, poly_order=3,
+                        clip_percentage=.10, num_peaks=3, distance=5):
+        smooth = self.smooth_data(data, window_length=window_length, poly_order=poly_order, axis=0)
+        frq_clipped, smooth_clipped, clipped_step_intervals = self.clip_dataset(frq, smooth, step_intervals,
+                                                                                clip_percentage)
+        peaks = self.get_peaks_batch(smooth_clipped, clipped_step_intervals, num_peaks, distance)
+        return frq_clipped, smooth_clipped, clipped_step_intervals, peaks
+
+    def get_delta_maps(self, frq, data, step_intervals, refine=None, **kwargs):
+        frq_clipped, smooth_clipped, _, peaks = self.analyse_dataset(frq, data, step_intervals, **kwargs)
+        if refine is not None:
+            peaks = self.refine_peaks(smooth_clipped, peaks, refine)
+        return self.get_peaks_delta_batch(peaks, frq_clipped)
+
+    @instrumented("get_peaks")
     def get_peaks(self, data, distance=5, dips=True):
         if len(data) <= 0:
             raise ValueError("Provided data for peak finidng is empty")
+        from scipy.signal import find_peaks
         if dips:
             return find_peaks(-data, distance=distance)
         else:
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class PreviewResult:
+    def __init__(self, factor, coarse_shift_map, shift_map, roi, idle_popt=None, active_popt=None):
+        self.factor = factor
+        # Active minus idle deltas (3, row, col) of the binned image and the merged full size map,
+        # which holds the full resolution deltas inside the region of interest
+        self.coarse_shift_map = coarse_shift_map
+        self.shift_map = shift_map
+        # Pixels (row, col) that were processed at full resolution
+        self.roi = roi
+        # Fitted Lorentzian parameters (54, row, col) inside the region of interest, NaN elsewhere
+        self.idle_popt = idle_popt
+        self.active_popt = active_popt
+
+
+class PreviewRunner:
+    def __init__(self, runner, factor=4, threshold=100e3, margin=1):
+        # threshold is the shift in Hz above which a binned pixel is refined, margin the no. of
+        # binned pixels around it that are refined as well
+        if factor < 1:
+            raise ValueError("Binning factor must be positive")
+        self.runner = runner
+        self.analyzer = runner.analyzer
+        self.factor = factor
+        self.threshold = threshold
+        self.margin = margin
+
+    def coarse_roi(self, coarse_shift_map):
+        # Binned pixels where any delta shifted by more than threshold, or that could not be
+        # analysed, grown by margin so that features on block edges are refined completely
+        roi = np.any(np.abs(coarse_shift_map) > self.threshold, axis=0) | np.any(np.isnan(coarse_shift_map), axis=0)
+        if self.margin > 0 and np.any(roi):
+            from scipy.ndimage import binary_dilation
+            roi = binary_dilation(roi, structure=np.ones((3, 3), dtype=bool), iterations=self.margin)
+        return roi
+
+    def run(self, idle_fname, active_fname):
+        cubes = {}
+        coarse_results = {}
+        for fname in (idle_fname, active_fname):
+            frq, step_intervals = self.analyzer.load_metadata(fname)
+            data = self.runner.normalised(fname)
+            cubes[fname] = frq, step_intervals, data
+            coarse_results[fname] = self.runner.analyse(fname, frq, self.analyzer.bin_image(data, self.factor),
+                                                        step_intervals, fit=False)
+        spatial_shape = cubes[idle_fname][2].shape[1:]
+        if cubes[active_fname][2].shape[1:] != spatial_shape:
+            raise ValueError("Idle and active acquisitions have different image shapes")
+        coarse_shift_map = self.runner.compare(coarse_results[idle_fname], coarse_results[active_fname])
+        roi = self.analyzer.expand_image(self.coarse_roi(coarse_shift_map), self.factor, spatial_shape)
+
+        shift_map = self.analyzer.expand_image(coarse_shift_map, self.factor, spatial_shape)
+        popt = {fname: None for fname in cubes}
+        if np.any(roi):
+            # Only the region of interest is smoothed, searched and fitted at full resolution, as a
+            # (frequency, pixel) cube of its pixels. Pixels next to each other in that cube are not
+            # necessarily neighbours in the image, so the fits are not warm started.
+            fine_results = {}
+            for fname, (frq, step_intervals, data) in cubes.items():
+                fine_results[fname] = self.runner.analyse(fname, frq, data[:, roi], step_intervals, warm_start=False)
+                if fine_results[fname].popt is not None:
+                    popt[fname] = np.full((len(fine_results[fname].popt),) + spatial_shape, np.nan)
+                    popt[fname][:, roi] = fine_results[fname].popt
+            shift_map[:, roi] = self.runner.compare(fine_results[idle_fname], fine_results[active_fname])
+        return PreviewResult(self.factor, coarse_shift_map, shift_map, roi, popt[idle_fname], popt[active_fname])
@@ -0,0 +1,135 @@
+import os
+import queue
+import re
+import threading
+import numpy as np
+
+RENDER_MODES = ("show", "file", "off")
+
+
+def decimate_trace(x, y, max_points):
+    # Min/max decimation: every bucket keeps its lowest and highest sample, so dips survive
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    if max_points is None or len(y) <= max_points:
+        return x, y
+    bucket_size = -(-len(y) // max(max_points // 2, 1))
+    num_buckets = -(-len(y) // bucket_size)
+    buckets = np.full(num_buckets * bucket_size, np.nan)
+    buckets[:len(y)] = y
+    buckets = buckets.reshape(num_buckets, bucket_size)
+    starts = np.arange(num_buckets) * bucket_size
+    keep = np.unique(np.concatenate([starts + np.nanargmin(buckets, axis=1), starts + np.nanargmax(buckets, axis=1)]))
+    return x[keep], y[keep]
+
+
+def draw_peaks(figure, x, y, peak_x, peak_y, title="", color="blue"):
+    axes = figure.add_subplot()
+    axes.plot(x * 1e-9, y, label='Smoothed Clipped Data', color=color)
+    axes.scatter(peak_x * 1e-9, peak_y, color='red', s=50, label='Detected Peaks', zorder=2.5)
+    axes.set_title(title)
+    axes.set_xlabel('Frequency GHz')
+    axes.set_ylabel('Normalized Intensity')
+    axes.legend()
+    axes.grid(True)
+
+
+def draw_image(figure, data, title="", cmap="viridis"):
+    axes = figure.add_subplot()
+    axes.imshow(data, cmap=cmap, interpolation='nearest')
+    axes.set_title(title)
+    axes.set_xlabel('Column Index')
+    axes.set_ylabel('Row Index')
+
+
+class Renderer:
+    def __init__(self, mode="show", output_dir="plots/", max_points=2000, background=True):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Render mode must be one of {RENDER_MODES}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.max_points = max_points
+        self.background = background
+        self.errors = []
+        self._count = 0
+        self._queue = None
+        self._thread = None
+
+    def __getstate__(self):
+        # Worker processes get their own render thread on first use
+        state = self.__dict__.copy()
+        state["_queue"] = None
+        state["_thread"] = None
+        return state
+
+    def next_path(self, title, extension):
+        self._count += 1
+        name = re.sub(r"[^A-Za-z0-9]+", "_", title).strip("_").lower() or "figure"
+        return os.path.join(self.output_dir, f"{os.getpid()}_{self._count:04d}_{name}.{extension}")
+
+    def render(self, draw, figsize, *args, **kwargs):
+        if self.mode == "off":
+            return
+        if self.mode == "show":
+            import matplotlib.pyplot as plt
+            figure = plt.figure(figsize=figsize)
+            draw(figure, *args, **kwargs)
+            plt.show()
+            return
+        self.submit(self.save_figure, draw, figsize, self.next_path(kwargs.get("title", ""), "png"), *args, **kwargs)
+
+    def render_line(self, x, y, title="", **kwargs):
+        # Interactive plotly line plot, written as standalone HTML in file mode
+        if self.mode == "off":
+            return
+        from esr import linep2dp
+        x, y = decimate_trace(x, y, self.max_points)
+        if self.mode == "show":
+            linep2dp(x, y, title=title, **kwargs)
+            return
+        self.submit(linep2dp, x, y, title=title, output_path=self.next_path(title, "html"), **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        if not self.background:
+            self.run_task(func, args, kwargs)
+            return
+        if self._thread is None:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self.worker, daemon=True)
+            self._thread.start()
+        self._queue.put((func, args, kwargs))
+
+    def save_figure(self, draw, figsize, path, *args, **kwargs):
+        # Figures are built without pyplot on the Agg canvas, which needs no display and is
+        # safe to use off the main thread
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        figure = Figure(figsize=figsize)
+        FigureCanvasAgg(figure)
+        draw(figure, *args, **kwargs)
+        figure.savefig(path)
+
+    def run_task(self, func, args, kwargs):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            func(*args, **kwargs)
+        except Exception as e:
+            self.errors.append(e)
+
+    def worker(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            self.run_task(func, args, kwargs)
+            self._queue.task_done()
+
+    def flush(self):
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import socket
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from peakanalyzer.cache import FileHashes
+
+FINAL_EVENTS = ("done", "error")
+
+
+class Job:
+    def __init__(self, job_id, idle_fname, active_fname, key):
+        self.id = job_id
+        self.idle_fname = idle_fname
+        self.active_fname = active_fname
+        self.key = key
+        self.history = []
+        self.listeners = []
+        self.result = None
+
+    def emit(self, event, **data):
+        message = {"job": self.id, "event": event, **data}
+        self.history.append(message)
+        for listener in self.listeners:
+            listener.put_nowait(message)
+
+    async def events(self):
+        # Every event of the job from the start, also for listeners that subscribe late
+        listener = asyncio.Queue()
+        for message in self.history:
+            listener.put_nowait(message)
+        self.listeners.append(listener)
+        try:
+            while True:
+                message = await listener.get()
+                yield message
+                if message["event"] in FINAL_EVENTS:
+                    return
+        finally:
+            self.listeners.remove(listener)
+
+
+def mean_values(maps):
+    # Mean of every map in Hz, NaN pixels ignored and None when there are none
+    return [None if np.all(np.isnan(values)) else float(np.nanmean(values)) for values in maps]
+
+
+def job_result(idle_deltas, active_deltas, shift_map):
+    return {"idle_deltas": mean_values(idle_deltas), "active_deltas": mean_values(active_deltas),
+            "mean_shift": mean_values(shift_map), "shift_map": shift_map.tolist()}
+
+
+class AnalysisService:
+    def __init__(self, runner, workers=2, max_queue=8, executor=None, max_results=32, catalog=None,
+                 datafolder=None):
+        # runner is a BatchRunner whose settings, stage cache and calibrations are used for every
+        # job. Jobs wait in a queue of at most max_queue entries, submitting to a full queue waits
+        # until there is room. With a catalog, datafolder is recataloged whenever a job is
+        # submitted, so that uploaded acquisitions show up in it.
+        if workers < 1:
+            raise ValueError("No. of workers must be positive")
+        self.runner = runner
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = executor
+        self.max_results = max_results
+        self.catalog = catalog
+        self.datafolder = datafolder
+        self.results = OrderedDict()
+        self.active_jobs = {}
+        # With a stage cache the file hashes are shared with it and kept across restarts
+        self.hashes = FileHashes() if runner.cache is None else runner.cache.hashes
+        self._ids = itertools.count(1)
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.stop()
+
+    def job_key(self, idle_fname, active_fname):
+        # Identifies a job by the contents of its files and the processing parameters
+        hashes = [self.hashes.file_hash(f"{fname}.{extension}") for fname in (idle_fname, active_fname)
+                  for extension in ("npy", "yaml")]
+        description = json.dumps(["service_result", hashes, self.runner.calibration_params()], sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def cached_result(self, key):
+        # Results are kept in memory and, with a stage cache, on disk across restarts
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+        arrays = None if self.runner.cache is None else self.runner.cache.get(key)
+        if arrays is None:
+            return None
+        return self.remember(key, job_result(arrays["idle_deltas"], arrays["active_deltas"], arrays["shift_map"]))
+
+    def remember(self, key, result):
+        self.results[key] = result
+        while len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+        return result
+
+    async def submit(self, idle_fname, active_fname):
+        # Completed results are served from the cache and a job that is already queued or running
+        # is shared, otherwise a new job is queued
+        if self.catalog is not None:
+            await asyncio.to_thread(self.catalog.update, self.datafolder, self.runner.analyzer)
+        key = await asyncio.to_thread(self.job_key, idle_fname, active_fname)
+        job = Job(next(self._ids), idle_fname, active_fname, key)
+        result = await asyncio.to_thread(self.cached_result, key)
+        if result is not None:
+            job.result = result
+            job.emit("done", cached=True, **job.result)
+        elif key in self.active_jobs:
+            return self.active_jobs[key]
+        else:
+            self.active_jobs[key] = job
+            await self._queue.put(job)
+            job.emit("queued", position=self._queue.qsize())
+        return job
+
+    async def analyse(self, fname, calibrate):
+        # Result of one acquisition, a reference is loaded from its calibration when it is still valid
+        calibrations = self.runner.calibrations if calibrate else None
+        params = self.runner.calibration_params()
+        if calibrations is not None:
+            result = await asyncio.to_thread(calibrations.load, fname, params)
+            if result is not None:
+                return result, True
+        loop = asyncio.get_running_loop()
+        result, stages = await loop.run_in_executor(self.executor, self.runner.preprocess_in_worker, fname)
+        self.runner.analyzer.metrics.merge(stages)
+        if calibrations is not None:
+            try:
+                await asyncio.to_thread(calibrations.save, self.runner.analyzer, result, params)
+            except OSError as e:
+                self.runner.errors[fname] = e
+        return result, False
+
+    async def worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                job.emit("started")
+                results = {}
+                for role, fname in (("idle", job.idle_fname), ("active", job.active_fname)):
+                    results[role], calibrated = await self.analyse(fname, calibrate=role == "idle")
+                    job.emit("partial", role=role, fname=fname, calibrated=calibrated,
+                             mean_deltas=mean_values(results[role].deltas))
+                shift_map = self.runner.compare(results["idle"], results["active"])
+                job.result = self.remember(job.key, job_result(results["idle"].deltas, results["active"].deltas,
+                                                               shift_map))
+                if self.runner.cache is not None:
+                    try:
+                        await asyncio.to_thread(self.runner.cache.put, job.key,
+                                                {"idle_deltas": results["idle"].deltas,
+                                                 "active_deltas": results["active"].deltas, "shift_map": shift_map})
+                    except OSError as e:
+                        self.runner.errors[(job.idle_fname, job.active_fname)] = e
+                job.emit("done", cached=False, **job.result)
+            except Exception as e:
+                job.emit("error", message=str(e))
+            finally:
+                self.active_jobs.pop(job.key, None)
+                self._queue.task_done()
+
+    async def handle_connection(self, reader, writer):
+        # JSON lines protocol: {"op": "submit", "idle": fname, "active": fname} streams back the
+        # job's events, {"op": "status"} reports the queue
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("op") == "status":
+                        await self.send(writer, {"event": "status", "queued": self._queue.qsize(),
+                                                 "max_queue": self.max_queue, "running": len(self.active_jobs)})
+                    elif request.get("op") == "submit":
+                        job = await self.submit(request["idle"], request["active"])
+                        async for message in job.events():
+                            await self.send(writer, message)
+                    else:
+                        raise ValueError(f"Unknown operation {request.get('op')}")
+                except (ValueError, KeyError, OSError) as e:
+                    await self.send(writer, {"event": "error", "message": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def send(self, writer, message):
+        writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class AnalysisClient:
+    # Blocking client for the JSON lines protocol of AnalysisService, e.g. for the Streamlit app
+    def __init__(self, host="127.0.0.1", port=8765, timeout=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, message):
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as connection:
+            connection.sendall(json.dumps(message).encode() + b"\n")
+            with connection.makefile("r") as lines:
+                for line in lines:
+                    reply = json.loads(line)
+                    yield reply
+                    if reply["event"] in FINAL_EVENTS or reply["event"] == "status":
+                        return
+
+    def submit(self, idle_fname, active_fname):
+        # Yields the job's events up to and including "done" or "error"
+        yield from self.request({"op": "submit", "idle": idle_fname, "active": active_fname})
+
+    def status(self):
+        return next(self.request({"op": "status"}))
+
+
+def main():
+    from peakanalyzer.peakanalyzer import PeakAnalyzer
+    from peakanalyzer.batch import BatchRunner
+    from peakanalyzer.render import Renderer
+    from peakanalyzer.cache import StageCache
+    from peakanalyzer.calibration import CalibrationStore
+    from peakanalyzer.catalog import AcquisitionCatalog
+    parser = argparse.ArgumentParser(description="Local ESR analysis service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=2, help="No. of jobs processed at the same time")
+    parser.add_argument("--max-queue", type=int, default=8, help="No. of jobs that may wait in the queue")
+    parser.add_argument("--datafolder", default="data/")
+    parser.add_argument("--window-length", type=int, default=20)
+    parser.add_argument("--poly-order", type=int, default=3)
+    parser.add_argument("--block-size", type=int, default=16,
+                        help="No. of frequencies normalised at a time, bounds the memory used for the raw cube")
+    parser.add_argument("--catalog", default=None,
+                        help="SQLite acquisition catalog of the data folder, updated whenever a job is submitted")
+    parser.add_argument("--calibration-dir", default=None,
+                        help="Store idle reference results here and reuse them while they are still valid")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Keep intermediate stage results and job results in this folder across restarts")
+    parser.add_argument("--cache-size", type=float, default=4.0,
+                        help="Maximum size of --cache-dir in GiB, least recently used entries are evicted")
+    args = parser.parse_args()
+
+    catalog = AcquisitionCatalog(args.catalog) if args.catalog else None
+    analyzer = PeakAnalyzer(args.datafolder, renderer=Renderer("off"), catalog=catalog)
+    cache = StageCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3)) if args.cache_dir else None
+    calibrations = CalibrationStore(args.calibration_dir) if args.calibration_dir else None
+    runner = BatchRunner(analyzer, window_length=args.window_length, poly_order=args.poly_order,
+                         block_size=args.block_size, cache=cache, calibrations=calibrations)
+
+    async def run():
+        async with AnalysisService(runner, workers=args.workers, max_queue=args.max_queue, catalog=catalog,
+                                   datafolder=args.datafolder) as service:
+            await service.serve(args.host, args.port)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
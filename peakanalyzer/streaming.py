@@ -0,0 +1,176 @@
+import os
+import queue
+import time
+import numpy as np
+from peakanalyzer.batch import AcquisitionResult
+
+
+class ClusterResult:
+    def __init__(self, cluster_index, peaks, refined_peaks, deltas):
+        self.cluster_index = cluster_index
+        # Peak indices of this cluster on the clipped frequency axis (num_peaks, row, col)
+        self.peaks = peaks
+        self.refined_peaks = refined_peaks
+        # Splitting deltas (3, row, col) known so far, NaN until both clusters of a pair are complete
+        self.deltas = deltas
+
+
+class StreamingAnalyzer:
+    def __init__(self, analyzer, frq, step_intervals, window_length=15, poly_order=3, clip_percentage=.10,
+                 num_peaks=3, distance=5, refine=None, normalised=False, dtype=None, fname=None):
+        self.analyzer = analyzer
+        self.frq = np.asarray(frq)
+        self.window_length = window_length
+        self.poly_order = poly_order
+        self.num_peaks = num_peaks
+        self.distance = distance
+        self.refine = refine
+        self.normalised = normalised
+        self.dtype = dtype
+        self.fname = fname
+        if np.sum(step_intervals) != len(self.frq):
+            raise ValueError("Step intervals don't add up to the length of the frequency axis")
+        self.clip_range = analyzer.get_clip_range(step_intervals, clip_percentage)
+        self.frq_clipped, _, self.step_intervals = analyzer.clip_dataset(self.frq, self.frq, step_intervals,
+                                                                         clip_percentage)
+        self.chunk_starts = np.cumsum(self.step_intervals) - self.step_intervals
+        self.data = None
+        self.smooth = None
+        self.peaks = None
+        self.refined_peaks = None
+        self.num_received = 0
+        self.num_smoothed = 0
+        self.num_clusters = 0
+        self.result = None
+
+    @property
+    def complete(self):
+        return self.result is not None
+
+    def push(self, block):
+        # Adds the next block of frequencies, raw (2, frequency, sweep, ...) unless normalised, and
+        # returns the clusters that it completed
+        if self.complete:
+            raise ValueError("All frequencies of the sweep have already been received")
+        with self.analyzer.metrics.timer("stream_push", block):
+            if self.normalised:
+                block = np.asarray(block, dtype=self.dtype)
+            else:
+                block = self.analyzer.normalise_dataset(block, dtype=self.dtype)
+            if self.num_received + len(block) > len(self.frq):
+                raise ValueError("Received more frequencies than the sweep has")
+            if self.data is None:
+                self.data = np.zeros((len(self.frq),) + block.shape[1:], dtype=block.dtype)
+                spatial_shape = block.shape[1:]
+                self.peaks = np.full((len(self.step_intervals) * self.num_peaks,) + spatial_shape, -1, dtype=np.intp)
+                self.refined_peaks = np.full(self.peaks.shape, -1.0)
+            self.data[self.num_received:self.num_received + len(block)] = block
+            self.num_received += len(block)
+            self.smooth_received()
+            clusters = []
+            while self.num_clusters < len(self.step_intervals) and self.cluster_ready(self.num_clusters):
+                clusters.append(self.finish_cluster(self.num_clusters))
+                self.num_clusters += 1
+            if self.num_received == len(self.frq):
+                self.result = self.finish()
+        return clusters
+
+    def smooth_received(self):
+        # Smoothing a slice gives the same values as smoothing the whole sweep wherever the filter
+        # window lies inside the slice, so the last window_length samples are only final once the
+        # next block (or the end of the sweep) is there. The slice starts window_length before the
+        # first sample that is not final yet.
+        end_index = self.num_received
+        if end_index < len(self.frq):
+            end_index -= self.window_length
+        if end_index <= self.num_smoothed or self.num_received < self.window_length:
+            return
+        start_index = max(self.num_smoothed - self.window_length, 0)
+        smooth = self.analyzer.smooth_data(self.data[start_index:self.num_received], window_length=self.window_length,
+                                           poly_order=self.poly_order, axis=0)
+        if self.smooth is None:
+            self.smooth = np.zeros(self.data.shape, dtype=smooth.dtype)
+        self.smooth[self.num_smoothed:end_index] = smooth[self.num_smoothed - start_index:end_index - start_index]
+        self.num_smoothed = end_index
+
+    def cluster_ready(self, cluster_index):
+        # One sample past the cluster is needed by the sub-sample refinement of a dip on its edge
+        end_index = self.clip_range + self.chunk_starts[cluster_index] + self.step_intervals[cluster_index]
+        return self.num_smoothed >= min(end_index + 1, len(self.frq))
+
+    def finish_cluster(self, cluster_index):
+        smooth_clipped = self.smooth[self.clip_range:len(self.frq) - self.clip_range]
+        start_step = self.chunk_starts[cluster_index]
+        chunk_data = smooth_clipped[start_step:start_step + self.step_intervals[cluster_index]]
+        spatial_shape = chunk_data.shape[1:]
+        chunk_peaks = self.analyzer.select_dips(chunk_data.reshape(len(chunk_data), -1), self.num_peaks, self.distance)
+        chunk_peaks = np.where(chunk_peaks >= 0, chunk_peaks + start_step, -1)
+        # Sort peaks based on index i.e. get the right order of peaks
+        chunk_peaks = np.sort(chunk_peaks, axis=0).reshape(self.num_peaks, *spatial_shape)
+        rows = slice(cluster_index * self.num_peaks, (cluster_index + 1) * self.num_peaks)
+        self.peaks[rows] = chunk_peaks
+        refined_peaks = None
+        if self.refine is not None:
+            refined_peaks = self.analyzer.refine_peaks(smooth_clipped, chunk_peaks, self.refine)
+            self.refined_peaks[rows] = refined_peaks
+        return ClusterResult(cluster_index, chunk_peaks, refined_peaks, self.deltas())
+
+    def deltas(self):
+        # Peaks of clusters that are not complete yet are still -1, which makes their deltas NaN
+        peaks = self.peaks if self.refine is None else self.refined_peaks
+        return self.analyzer.get_peaks_delta_batch(peaks, self.frq_clipped)
+
+    def finish(self):
+        smooth_clipped = self.smooth[self.clip_range:len(self.frq) - self.clip_range]
+        return AcquisitionResult(self.fname, self.frq_clipped, smooth_clipped, self.step_intervals, self.peaks,
+                                 self.deltas(), refined_peaks=None if self.refine is None else self.refined_peaks)
+
+    def stream(self, blocks):
+        # Yields every cluster as soon as it is complete, self.result holds the final result afterwards
+        for block in blocks:
+            yield from self.push(block)
+            if self.complete:
+                return
+        raise ValueError("The sweep ended before all frequencies were received")
+
+    def run(self, blocks, on_cluster=None):
+        for cluster in self.stream(blocks):
+            if on_cluster is not None:
+                on_cluster(cluster)
+        return self.result
+
+
+def queue_blocks(block_queue, timeout=None):
+    # Blocks put on a queue.Queue by the acquisition, None marks the end of the sweep
+    while True:
+        try:
+            block = block_queue.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("No block arrived within the timeout")
+        if block is None:
+            return
+        yield block
+
+
+def file_blocks(path, frame_shape, num_frames, dtype=np.float64, poll_interval=0.1, timeout=None):
+    # Blocks from a file that the acquisition appends to: one raw frame of frame_shape
+    # (2, sweep, row, col) per frequency, written in C order. Every complete frame that has
+    # landed is yielded as a (2, frequency, sweep, row, col) block.
+    dtype = np.dtype(dtype)
+    frame_size = int(np.prod(frame_shape)) * dtype.itemsize
+    num_read = 0
+    last_growth = time.monotonic()
+    while num_read < num_frames:
+        available = (os.path.getsize(path) // frame_size if os.path.exists(path) else 0) - num_read
+        available = min(available, num_frames - num_read)
+        if available <= 0:
+            if timeout is not None and time.monotonic() - last_growth > timeout:
+                raise TimeoutError(f"{path} stopped growing after {num_read} of {num_frames} frequencies")
+            time.sleep(poll_interval)
+            continue
+        with open(path, "rb") as f:
+            f.seek(num_read * frame_size)
+            frames = np.frombuffer(f.read(available * frame_size), dtype=dtype)
+        num_read += available
+        last_growth = time.monotonic()
+        yield np.moveaxis(frames.reshape(available, *frame_shape), 0, 1)
@@ -0,0 +1,67 @@
+import numpy as np
+import yaml
+
+# Centres of the six sweep windows and the 14N hyperfine splitting seen in the bundled acquisitions
+INTERVAL_CENTRES = (2.78e9, 2.805e9, 2.845e9, 2.893e9, 2.93e9, 2.951e9)
+INTERVAL_SPAN = 20e6
+HYPERFINE_SPLITTING = 2.16e6
+# Relative shift of the 1-6, 2-5 and 3-4 resonance pairs for the same current density
+PAIR_SHIFT_SCALE = (1.0, 0.6, 0.3)
+
+
+def generate_frequency_axis(points_per_interval=151, interval_centres=INTERVAL_CENTRES, interval_span=INTERVAL_SPAN):
+    frq = np.concatenate([np.linspace(centre - interval_span / 2, centre + interval_span / 2, points_per_interval)
+                          for centre in interval_centres])
+    return frq, np.full(len(interval_centres), points_per_interval)
+
+
+def generate_shift_map(height, width, max_shift):
+    # Smooth bump standing in for the field of a current carrying trace
+    rows, cols = np.meshgrid(np.linspace(-1, 1, height), np.linspace(-1, 1, width), indexing="ij")
+    return max_shift * np.exp(-(rows ** 2 + (2 * cols) ** 2) * 4)
+
+
+def generate_true_centres(frq, step_intervals, shift_map):
+    interval_ends = np.cumsum(step_intervals)
+    interval_centres = (frq[interval_ends - step_intervals] + frq[interval_ends - 1]) / 2
+    num_intervals = len(interval_centres)
+    centres = np.empty((3 * num_intervals,) + shift_map.shape)
+    for i, interval_centre in enumerate(interval_centres):
+        # Lower resonances move down and their partners in the upper half move up
+        pair_index = min(i, num_intervals - 1 - i)
+        direction = -1 if i < num_intervals / 2 else 1
+        shift = direction * PAIR_SHIFT_SCALE[pair_index % len(PAIR_SHIFT_SCALE)] * shift_map
+        for j, offset in enumerate((-HYPERFINE_SPLITTING, 0, HYPERFINE_SPLITTING)):
+            centres[3 * i + j] = interval_centre + offset + shift
+    return centres
+
+
+def generate_dataset(analyzer, height=50, width=50, points_per_interval=151, num_sweeps=4, frq=None,
+                     step_intervals=None, contrast=0.02, linewidth=0.5e6, max_shift=1e6, counts=1000.0,
+                     noise=0.002, dtype=np.float64, seed=None):
+    # Builds a raw (2, frequency, sweep, row, col) cube as consumed by PeakAnalyzer.normalise_dataset:
+    # channel 1 is the reference count rate and channel 0 the signal carrying the inverted
+    # triple Lorentzian dips. Returns the frequency axis, raw cube, step intervals and the
+    # ground truth dip centres as (18, row, col).
+    rng = np.random.default_rng(seed)
+    if frq is None:
+        frq, step_intervals = generate_frequency_axis(points_per_interval)
+    frq, step_intervals = np.asarray(frq, dtype=np.float64), np.asarray(step_intervals)
+    true_centres = generate_true_centres(frq, step_intervals, generate_shift_map(height, width, max_shift))
+
+    contrast_spectrum = np.ones((len(frq), height, width))
+    for centre in true_centres:
+        contrast_spectrum += analyzer.lorentzian(frq[:, None, None], contrast, centre, linewidth)
+
+    shape = (len(frq), num_sweeps, height, width)
+    raw = np.empty((2,) + shape, dtype=dtype)
+    raw[1] = counts * (1 + rng.normal(0, noise, shape))
+    raw[0] = raw[1] * contrast_spectrum[:, None] * (1 + rng.normal(0, noise, shape))
+    return frq, raw, step_intervals, true_centres
+
+
+def save_dataset(filename, frq, raw, step_intervals):
+    np.save(f"{filename}.npy", raw)
+    with open(f"{filename}.yaml", "w") as f:
+        yaml.safe_dump({"step_intervals": np.asarray(step_intervals).tolist(),
+                        "frequency_values": np.asarray(frq).tolist()}, f)
@@ -0,0 +1,25 @@
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+
+
+class CountingPeakAnalyzer(PeakAnalyzer):
+    # Records the files it loads and the expensive stages it runs, in order, and how the image is fitted
+    def __init__(self, datafolder):
+        super().__init__(datafolder)
+        self.loaded_fnames = []
+        self.calls = []
+        self.fit_workers = []
+
+    def load_data(self, filename, mmap=False):
+        self.loaded_fnames.append(filename)
+        self.calls.append("load_data")
+        return super().load_data(filename, mmap=mmap)
+
+    def smooth_data(self, data, window_length=15, poly_order=3, axis=-1):
+        self.calls.append("smooth_data")
+        return super().smooth_data(data, window_length, poly_order, axis)
+
+    def curve_fitting_image(self, frq, data, peaks, step_intervals=None, depth=200000, workers=None,
+                            warm_start=False):
+        self.fit_workers.append(workers)
+        return super().curve_fitting_image(frq, data, peaks, step_intervals=step_intervals, depth=depth,
+                                           workers=workers, warm_start=warm_start)
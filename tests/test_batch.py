@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import yaml
+from peakanalyzer.batch import BatchRunner
+from tests.helpers import CountingPeakAnalyzer
+
+
+class TestBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fnames = []
+        rng = np.random.default_rng(0)
+        for i in range(4):
+            fname = os.path.join(self.tmp_dir.name, f"acquisition_{i}")
+            np.save(f"{fname}.npy", rng.uniform(100, 1000, (2, 120, 3, 4, 5)))
+            with open(f"{fname}.yaml", "w") as f:
+                yaml.safe_dump({"step_intervals": [20] * 6, "frequency_values": np.linspace(2.8e9, 2.9e9, 120).tolist()}, f)
+            self.fnames.append(fname)
+        self.analyzer = CountingPeakAnalyzer('data_dir/')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_processes_each_acquisition_once(self):
+        runner = BatchRunner(self.analyzer, window_length=7)
+
+        results, shift_maps = runner.run(self.fnames[:2], self.fnames[2:])
+
+        self.assertEqual(sorted(self.analyzer.loaded_fnames), sorted(self.fnames))
+        self.assertEqual(list(shift_maps), [(idle, active) for idle in self.fnames[:2] for active in self.fnames[2:]])
+        idle_result, active_result = results[self.fnames[0]], results[self.fnames[3]]
+        self.assertEqual(idle_result.peaks.shape, (18, 4, 5))
+        np.testing.assert_array_equal(shift_maps[(self.fnames[0], self.fnames[3])],
+                                      active_result.deltas - idle_result.deltas)
+
+    def test_run_skips_pairs_of_failed_acquisitions(self):
+        runner = BatchRunner(self.analyzer, window_length=7)
+        missing_fname = os.path.join(self.tmp_dir.name, "missing")
+
+        _, shift_maps = runner.run([missing_fname], self.fnames[2:])
+
+        self.assertEqual(shift_maps, {})
+        self.assertIn(missing_fname, runner.errors)
+
+    def test_run_with_workers_matches_serial_run(self):
+        serial_results, serial_shift_maps = BatchRunner(self.analyzer, window_length=7).run(self.fnames[:2],
+                                                                                            self.fnames[2:])
+
+        results, shift_maps = BatchRunner(self.analyzer, window_length=7, workers=2).run(self.fnames[:2],
+                                                                                         self.fnames[2:])
+
+        self.assertEqual(list(results), list(serial_results))
+        self.assertEqual(list(shift_maps), list(serial_shift_maps))
+        for pair, shift_map in shift_maps.items():
+            np.testing.assert_array_equal(shift_map, serial_shift_maps[pair])
+
+    def test_workers_fit_the_pixels_of_fewer_files(self):
+        runner = BatchRunner(self.analyzer, window_length=7, workers=2, fit=True, fit_depth=100)
+
+        results, _ = runner.run([self.fnames[0]], [])
+
+        self.assertEqual(self.analyzer.fit_workers, [2])
+        self.assertEqual(results[self.fnames[0]].popt.shape, (54, 4, 5))
+
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from peakanalyzer.batch import BatchRunner
+from peakanalyzer.cache import StageCache
+from peakanalyzer.synthetic import generate_dataset, save_dataset
+from tests.helpers import CountingPeakAnalyzer
+
+
+class TestStageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_keys_depend_on_parent_and_parameters(self):
+        cache = StageCache(self.cache_dir)
+
+        key = cache.key("parent", "smooth", window_length=15, poly_order=3)
+
+        self.assertEqual(key, cache.key("parent", "smooth", poly_order=3, window_length=15))
+        self.assertNotEqual(key, cache.key("parent", "smooth", window_length=17, poly_order=3))
+        self.assertNotEqual(key, cache.key("other", "smooth", window_length=15, poly_order=3))
+
+    def test_get_and_put(self):
+        cache = StageCache(self.cache_dir)
+
+        self.assertIsNone(cache.get("ab" * 32))
+        cache.put("ab" * 32, {"peaks": np.arange(18)})
+
+        np.testing.assert_array_equal(cache.get("ab" * 32)["peaks"], np.arange(18))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = StageCache(self.cache_dir, max_bytes=3300)
+        for key in ("aa", "bb", "cc"):
+            cache.put(key * 32, {"data": np.zeros(100)})
+            time.sleep(0.01)
+        cache.get("aa" * 32)
+        cache.put("dd" * 32, {"data": np.zeros(100)})
+
+        self.assertIsNotNone(cache.get("aa" * 32))
+        self.assertIsNone(cache.get("bb" * 32))
+        self.assertLessEqual(cache.size(), 3300)
+
+
+    def test_concurrent_writes_of_the_same_entry(self):
+        cache = StageCache(self.cache_dir)
+        arrays = {"data": np.arange(10000)}
+
+        with ThreadPoolExecutor(8) as executor:
+            list(executor.map(lambda _: cache.put("ab" * 32, arrays), range(64)))
+
+        np.testing.assert_array_equal(cache.get("ab" * 32)["data"], arrays["data"])
+        self.assertEqual([fname for _, _, fnames in os.walk(self.cache_dir) for fname in fnames
+                          if fname.endswith(".tmp")], [])
+
+
+class TestCachedBatchRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.analyzer = CountingPeakAnalyzer('data_dir/')
+        self.fname = os.path.join(self.tmp_dir.name, "acquisition")
+        save_dataset(self.fname, *generate_dataset(self.analyzer, height=3, width=3, seed=0)[:3])
+        self.cache = StageCache(os.path.join(self.tmp_dir.name, "cache"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_parameter_sweep_only_recomputes_downstream_stages(self):
+        uncached = BatchRunner(self.analyzer, window_length=20, distance=5).preprocess(self.fname)
+        BatchRunner(self.analyzer, window_length=20, distance=5, cache=self.cache).preprocess(self.fname)
+        self.analyzer.calls = []
+
+        result = BatchRunner(self.analyzer, window_length=20, distance=7, cache=self.cache).preprocess(self.fname)
+        self.assertEqual(self.analyzer.calls, [])
+
+        cached = BatchRunner(self.analyzer, window_length=20, distance=5, cache=self.cache).preprocess(self.fname)
+        np.testing.assert_array_equal(cached.smooth, uncached.smooth)
+        np.testing.assert_array_equal(cached.peaks, uncached.peaks)
+        np.testing.assert_array_equal(cached.deltas, uncached.deltas)
+        self.assertEqual(result.peaks.shape, (18, 3, 3))
+
+        BatchRunner(self.analyzer, window_length=15, distance=5, cache=self.cache).preprocess(self.fname)
+        self.assertEqual(self.analyzer.calls, ["smooth_data"])
@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from peakanalyzer.batch import BatchRunner
+from peakanalyzer.calibration import CalibrationStore, ReferenceCalibration, source_key
+from peakanalyzer.synthetic import generate_dataset, save_dataset
+from tests.helpers import CountingPeakAnalyzer
+
+
+class TestCalibration(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.analyzer = CountingPeakAnalyzer('data_dir/')
+        self.fnames = []
+        for i in range(2):
+            fname = os.path.join(self.tmp_dir.name, f"acquisition_{i}")
+            save_dataset(fname, *generate_dataset(self.analyzer, height=2, width=3, seed=i)[:3])
+            self.fnames.append(fname)
+        self.store = CalibrationStore(os.path.join(self.tmp_dir.name, "calibrations"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip_and_rejection(self):
+        runner = BatchRunner(self.analyzer, window_length=20, refine="parabolic")
+        result = runner.preprocess(self.fnames[0])
+        params = runner.calibration_params()
+        path = self.store.path(self.fnames[0])
+        ReferenceCalibration.from_result(self.analyzer, result, params).save(path)
+
+        calibration = ReferenceCalibration.load(path, params, source_key(self.fnames[0]))
+
+        np.testing.assert_array_equal(calibration.peaks, result.peaks)
+        np.testing.assert_array_equal(calibration.deltas, result.deltas)
+        np.testing.assert_array_equal(calibration.peak_frequencies,
+                                      self.analyzer.get_peak_frequencies(result.refined_peaks, result.frq))
+        self.assertIsNone(calibration.popt)
+        with self.assertRaises(ValueError):
+            ReferenceCalibration.load(path, dict(params, distance=7))
+        with self.assertRaises(ValueError):
+            ReferenceCalibration.load(path, params, source_key(self.fnames[1]))
+        with self.assertRaises(ValueError):
+            ReferenceCalibration.load(path, params, fname=self.fnames[1])
+
+    def test_references_with_the_same_name_are_kept_apart(self):
+        other_fname = os.path.join(self.tmp_dir.name, "other", "acquisition_0")
+        os.makedirs(os.path.dirname(other_fname))
+        save_dataset(other_fname, *generate_dataset(self.analyzer, height=2, width=3, max_shift=1e6, seed=2)[:3])
+        runner = BatchRunner(self.analyzer, window_length=20)
+        params = runner.calibration_params()
+        for fname in (self.fnames[0], other_fname):
+            self.store.save(self.analyzer, runner.preprocess(fname), params)
+
+        self.assertNotEqual(self.store.path(self.fnames[0]), self.store.path(other_fname))
+        for fname in (self.fnames[0], other_fname):
+            np.testing.assert_array_equal(self.store.load(fname, params).deltas, runner.preprocess(fname).deltas)
+
+    def test_run_reuses_calibrated_reference(self):
+        BatchRunner(self.analyzer, window_length=20, calibrations=self.store).run(self.fnames[:1], self.fnames[1:])
+        expected_results, expected_shift_maps = BatchRunner(self.analyzer, window_length=20).run(self.fnames[:1],
+                                                                                                 self.fnames[1:])
+        self.analyzer.loaded_fnames = []
+
+        runner = BatchRunner(self.analyzer, window_length=20, calibrations=self.store)
+        results, shift_maps = runner.run(self.fnames[:1], self.fnames[1:])
+
+        self.assertEqual(self.analyzer.loaded_fnames, self.fnames[1:])
+        self.assertIsNone(results[self.fnames[0]].smooth)
+        np.testing.assert_array_equal(shift_maps[tuple(self.fnames)], expected_shift_maps[tuple(self.fnames)])
+
+        BatchRunner(self.analyzer, window_length=15, calibrations=self.store).run(self.fnames[:1], self.fnames[1:])
+        self.assertEqual(self.analyzer.loaded_fnames, self.fnames[1:] + self.fnames)
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+import numpy as np
+import yaml
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.catalog import AcquisitionCatalog
+
+
+class LoggingPeakAnalyzer(PeakAnalyzer):
+    def __init__(self, datafolder, **kwargs):
+        self.parsed_fnames = []
+        super().__init__(datafolder, **kwargs)
+
+    def load_metadata(self, filename, use_sidecar=True):
+        self.parsed_fnames.append(os.path.basename(filename))
+        return super().load_metadata(filename, use_sidecar)
+
+
+class TestAcquisitionCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.datafolder = self.tmp_dir.name + "/"
+        os.makedirs(self.datafolder + "without_current")
+        os.makedirs(self.datafolder + "with_current")
+        self.catalog = AcquisitionCatalog(os.path.join(self.tmp_dir.name, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def add_acquisition(self, subdir, name):
+        fname = os.path.join(self.datafolder + subdir, name)
+        np.save(f"{fname}.npy", np.zeros((2, 6, 1, 3, 4)))
+        with open(f"{fname}.yaml", "w") as f:
+            yaml.safe_dump({"step_intervals": [1] * 6, "frequency_values": [2.7e9 + i * 1e6 for i in range(6)]}, f)
+        return self.datafolder + subdir + name
+
+    def test_catalog_records_metadata_and_matches_load_fnames(self):
+        reference = self.add_acquisition("without_current/", "ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50")
+        active = self.add_acquisition("with_current/", "ESR_Continuous_2024-03-07-17-58-48_PCB_Top_25mA_50x50")
+
+        analyzer = PeakAnalyzer(self.datafolder, catalog=self.catalog)
+
+        self.assertEqual(analyzer.get_idle_fname_list(), [reference])
+        self.assertEqual(analyzer.get_active_fname_list(), [active])
+        entry = self.catalog.get(reference)
+        self.assertEqual(entry["role"], "idle")
+        self.assertEqual(entry["sample"], "PCB")
+        self.assertEqual(entry["acquired_at"], "2024-03-07T17:46:03")
+        self.assertEqual(entry["shape"], (2, 6, 1, 3, 4))
+        self.assertEqual(entry["frequency_max"], 2.705e9)
+        self.assertEqual(entry["step_intervals"], [1] * 6)
+
+    def test_update_is_incremental(self):
+        self.add_acquisition("without_current/", "ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50")
+        LoggingPeakAnalyzer(self.datafolder, catalog=self.catalog)
+
+        analyzer = LoggingPeakAnalyzer(self.datafolder, catalog=self.catalog)
+        self.assertEqual(analyzer.parsed_fnames, [])
+
+        time.sleep(0.01)
+        self.add_acquisition("without_current/", "ESR_Continuous_2024-04-01-09-00-00_PCB_ref_50x50")
+        analyzer = LoggingPeakAnalyzer(self.datafolder, catalog=self.catalog)
+        self.assertEqual(analyzer.parsed_fnames, ["ESR_Continuous_2024-04-01-09-00-00_PCB_ref_50x50"])
+
+        os.remove(analyzer.get_idle_fname_list()[0] + ".npy")
+        analyzer = LoggingPeakAnalyzer(self.datafolder, catalog=self.catalog)
+        self.assertEqual(len(analyzer.get_idle_fname_list()), 1)
+
+    def test_acquisition_added_during_scan_is_cataloged_next_time(self):
+        self.add_acquisition("with_current/", "ESR_Continuous_2024-03-07-17-58-48_PCB_Top_25mA_50x50")
+        late_name = "ESR_Continuous_2024-03-07-18-10-00_PCB_Top_50mA_50x50"
+        test = self
+
+        class AcquiringPeakAnalyzer(LoggingPeakAnalyzer):
+            # Another acquisition lands while the catalog is parsing the first one
+            def load_metadata(self, filename, use_sidecar=True):
+                if not os.path.exists(test.datafolder + "with_current/" + late_name + ".npy"):
+                    time.sleep(0.01)
+                    test.add_acquisition("with_current/", late_name)
+                return super().load_metadata(filename, use_sidecar)
+
+        AcquiringPeakAnalyzer(self.datafolder, catalog=self.catalog)
+
+        analyzer = LoggingPeakAnalyzer(self.datafolder, catalog=self.catalog)
+        self.assertIn(self.datafolder + "with_current/" + late_name, analyzer.get_active_fname_list())
+
+    def test_query(self):
+        self.add_acquisition("without_current/", "ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50")
+        newer = self.add_acquisition("without_current/", "ESR_Continuous_2024-04-01-09-00-00_PCB_ref_50x50")
+        self.add_acquisition("without_current/", "ESR_Continuous_2024-04-02-09-00-00_Chip_ref_50x50")
+        self.add_acquisition("with_current/", "ESR_Continuous_2024-04-03-09-00-00_PCB_Top_25mA_50x50")
+        self.catalog.update(self.datafolder, PeakAnalyzer('data_dir/'))
+
+        self.assertEqual(self.catalog.query(role="idle", sample="PCB", since=datetime(2024, 3, 8)), [newer])
+        self.assertEqual(len(self.catalog.query(sample="PCB")), 3)
+        self.assertEqual(self.catalog.query(datafolder="elsewhere/"), [])
@@ -0,0 +1,30 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def loaded_modules(statement, modules):
+    # Checked in a fresh interpreter, the test run itself has imported everything already
+    script = f"import sys\n{statement}\nprint(*[name for name in {modules!r} if name in sys.modules])"
+    return subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True,
+                          check=True).stdout.split()
+
+
+class TestImports(unittest.TestCase):
+    def test_core_does_not_import_plotting_or_fitting(self):
+        heavy = ["matplotlib", "plotly", "esr", "scipy.optimize", "scipy.signal", "scipy.ndimage"]
+        for module in ["peakanalyzer.peakanalyzer", "peakanalyzer.batch", "peakanalyzer.streaming",
+                       "peakanalyzer.preview"]:
+            self.assertEqual(loaded_modules(f"import {module}", heavy), [], module)
+
+    def test_smoothing_loads_scipy_on_first_use(self):
+        statement = ("import numpy as np\nfrom peakanalyzer.peakanalyzer import PeakAnalyzer\n"
+                     "PeakAnalyzer('data_dir/').smooth_data(np.zeros((40, 4)), window_length=20, axis=0)")
+        self.assertEqual(loaded_modules(statement, ["scipy.signal", "matplotlib"]), ["scipy.signal"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+
+    def test_methods_are_recorded(self):
+        data = np.random.normal(0, 1, (100, 3))
+
+        self.analyzer.smooth_data(data, axis=0)
+        self.analyzer.smooth_data(data, axis=0)
+        self.analyzer.get_peaks(data[:, 0])
+
+        stats = self.analyzer.metrics.stages
+        self.assertEqual(stats["smooth_data"]["calls"], 2)
+        self.assertEqual(stats["smooth_data"]["items"], 600)
+        self.assertEqual(stats["smooth_data"]["bytes"], 2 * data.nbytes)
+        self.assertEqual(stats["get_peaks"]["calls"], 1)
+
+    def test_curve_fitting_records_function_evaluations(self):
+        x = np.linspace(0, 10, 200)
+        y = self.analyzer.fit_cluster(x, 1.0, 4.0, 0.5, 1.0, 5.0, 0.5, 1.0, 6.0, 0.5)
+
+        self.analyzer.curve_fitting_cluster(x, y, [80, 99, 119])
+
+        self.assertGreater(self.analyzer.metrics.stages["curve_fitting_cluster"]["nfev"], 0)
+
+    def test_failed_calls_are_recorded(self):
+        x = np.linspace(0, 60, 600)
+        centres = [centre + offset for centre in range(5, 60, 10) for offset in (-1.5, 0, 1.5)]
+        y = 1 + self.analyzer.multi_lorentzian(x, *np.ravel([[0.05, centre, 0.1] for centre in centres]))
+        peaks = np.array([np.argmin(np.abs(x - centre)) for centre in centres])
+
+        self.analyzer.curve_fitting_by_cluster(x, y, peaks, [100] * 6, depth=1)
+        with self.assertRaises(ValueError):
+            self.analyzer.smooth_data(np.zeros(3), window_length=15)
+
+        stats = self.analyzer.metrics.stages
+        self.assertEqual(stats["curve_fitting_cluster"]["calls"], 6)
+        self.assertEqual(stats["curve_fitting_cluster"]["failures"], 6)
+        self.assertEqual(stats["smooth_data"]["failures"], 1)
+
+    def test_disabled_metrics_record_nothing(self):
+        analyzer = PeakAnalyzer('data_dir/', metrics=Metrics(enabled=False))
+
+        analyzer.smooth_data(np.random.normal(0, 1, 100))
+
+        self.assertEqual(analyzer.metrics.stages, {})
+
+    def test_export(self):
+        metrics = Metrics()
+        metrics.record("load_data", 0.5, items=10, nbytes=80)
+        metrics.record("load_data", 1.5, items=10, nbytes=80)
+        metrics.merge({"load_data": {"calls": 1, "failures": 0, "total_time": 1.0, "max_time": 2.0,
+                                     "items": 5, "bytes": 40, "nfev": 0}})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            metrics.export(os.path.join(tmp_dir, "metrics.json"))
+            metrics.export(os.path.join(tmp_dir, "metrics.csv"))
+            with open(os.path.join(tmp_dir, "metrics.json")) as f:
+                stages = json.load(f)["stages"]
+            with open(os.path.join(tmp_dir, "metrics.csv")) as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(stages[0]["calls"], 3)
+        self.assertEqual(stages[0]["total_time"], 3.0)
+        self.assertEqual(stages[0]["max_time"], 2.0)
+        self.assertEqual(stages[0]["bytes"], 200)
+        self.assertEqual(rows[0]["stage"], "load_data")
+        self.assertEqual(float(rows[0]["mean_time"]), 1.0)
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.parallel import SharedArray, attach_shared_array, split_range
+
+
+class SpectrumSumPeakAnalyzer(PeakAnalyzer):
+    def curve_fitting(self, x, y, peaks, depth=200000, analytic_jacobian=True, initial_guesses=None):
+        return np.full(54, np.sum(y)), np.zeros((54, 54))
+
+
+class TestParallel(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+
+    def test_split_range(self):
+        self.assertEqual(split_range(10, 3), [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(split_range(2, 8), [(0, 1), (1, 2)])
+        self.assertEqual(split_range(0, 4), [])
+
+    def test_shared_array_round_trip(self):
+        data = np.arange(12.0).reshape(3, 4)
+
+        with SharedArray(data) as shared_data:
+            shm, attached = attach_shared_array(shared_data.spec)
+            np.testing.assert_array_equal(attached, data)
+            del attached
+            shm.close()
+
+    def test_curve_fitting_image_with_workers_keeps_pixel_order(self):
+        analyzer = SpectrumSumPeakAnalyzer('data_dir/')
+        data = np.random.uniform(0, 1, (40, 5, 7))
+        peaks = np.zeros((18, 5, 7), dtype=int)
+        peaks[:, 4, 6] = -1
+
+        popt = analyzer.curve_fitting_image(np.arange(40), data, peaks, workers=3)
+
+        self.assertEqual(popt.shape, (54, 5, 7))
+        expected = np.array([[np.sum(data[:, row, col]) for col in range(7)] for row in range(5)])
+        expected[4, 6] = np.nan
+        for i in range(54):
+            np.testing.assert_array_equal(popt[i], expected)
+
+    def test_warm_started_curve_fitting_image_with_workers_keeps_pixel_order(self):
+        analyzer = SpectrumSumPeakAnalyzer('data_dir/')
+        data = np.random.uniform(0, 1, (40, 5, 7))
+        peaks = np.zeros((18, 5, 7), dtype=int)
+
+        popt = analyzer.curve_fitting_image(np.arange(40), data, peaks, workers=2, warm_start=True)
+
+        expected = np.array([[np.sum(data[:, row, col]) for col in range(7)] for row in range(5)])
+        np.testing.assert_array_equal(popt[0], expected)
@@ -1,8 +1,22 @@
+import os
+import tempfile
 import unittest
 import numpy as np
+import yaml
 from scipy.signal import find_peaks
 from peakanalyzer.peakanalyzer import PeakAnalyzer
 
+class DivergingWarmStartPeakAnalyzer(PeakAnalyzer):
+    # Returns the guesses from the detected dips unchanged, but moves seeded fits off the axis
+    seeded_fits = 0
+
+    def curve_fitting(self, x, y, peaks, depth=200000, analytic_jacobian=True, initial_guesses=None):
+        if initial_guesses is None:
+            return np.array(self.generate_parameters_for_fitting(x, y, peaks)), np.zeros((54, 54))
+        self.seeded_fits += 1
+        return np.asarray(initial_guesses) + 1e3, np.zeros((54, 54))
+
+
 class TestPeakAnalyzer(unittest.TestCase):
     def setUp(self):
         self.data_folder = 'data/'
@@ -39,3 +53,196 @@ class TestPeakAnalyzer(unittest.TestCase):
         # Check error handling for empty array
         with self.assertRaises(ValueError):
             self.analyzer.smooth_data(np.array([]))
+
+    def test_get_peaks_batch_matches_get_peaks(self):
+        data = np.cumsum(np.random.normal(0, 1, (60, 4, 5)), axis=0)
+        step_intervals = [20, 20, 20]
+
+        peaks = self.analyzer.get_peaks_batch(data, step_intervals)
+
+        self.assertEqual(peaks.shape, (9, 4, 5))
+        for row in range(4):
+            for col in range(5):
+                expected_peaks = []
+                start_step = 0
+                for chunk in self.analyzer.chunk_array_by_sizes(data[:, row, col], step_intervals):
+                    chunk_peaks, _ = self.analyzer.get_peaks(chunk)
+                    deepest = sorted(chunk_peaks, key=lambda peak: chunk[peak])[:3]
+                    deepest += [-1 - start_step] * (3 - len(deepest))
+                    expected_peaks.extend(sorted(peak + start_step for peak in deepest))
+                    start_step += len(chunk)
+                np.testing.assert_array_equal(peaks[:, row, col], expected_peaks)
+
+    def test_get_peaks_delta_batch(self):
+        frq = np.linspace(0, 17, 18)
+        peaks = np.arange(18).reshape(18, 1, 1)
+
+        deltas = self.analyzer.get_peaks_delta_batch(peaks, frq)
+
+        self.assertEqual(deltas.shape, (3, 1, 1))
+        np.testing.assert_allclose(deltas[:, 0, 0], self.analyzer.get_peaks_delta(np.arange(18), frq))
+
+    def test_refine_peaks_finds_sub_sample_centre(self):
+        x = np.arange(40, dtype=float)
+        data = np.stack([(x - 12.3) ** 2, (x - 25.8) ** 2, np.abs(x - 30.25)], axis=1)
+        peaks = np.array([[12, 26, 30], [-1, 0, 39]])
+
+        parabolic = self.analyzer.refine_peaks(data, peaks)
+        centroid = self.analyzer.refine_peaks(data, peaks, method="centroid")
+
+        np.testing.assert_allclose(parabolic[0, :2], [12.3, 25.8])
+        np.testing.assert_array_equal(parabolic[1], [-1, 0, 39])
+        np.testing.assert_array_equal(centroid[1], [-1, 0, 39])
+        for refined in (parabolic, centroid):
+            self.assertTrue(np.all(np.abs(refined[0] - [12.3, 25.8, 30.25]) < 0.2))
+        with self.assertRaises(ValueError):
+            self.analyzer.refine_peaks(data, peaks, method="spline")
+
+    def test_get_peaks_delta_batch_interpolates_fractional_peaks(self):
+        frq = np.linspace(0, 36, 19)
+        peaks = np.arange(18).reshape(18, 1) + np.array([[0.0, 0.5]])
+
+        deltas = self.analyzer.get_peaks_delta_batch(peaks, frq)
+
+        np.testing.assert_allclose(deltas[:, 0], self.analyzer.get_peaks_delta(peaks[:, 0], frq))
+        np.testing.assert_allclose(deltas[:, 1], self.analyzer.get_peaks_delta(np.arange(18), frq + 1))
+
+    def test_get_peaks_delta_of_missing_peaks_is_nan(self):
+        frq = np.linspace(0, 36, 19)
+        for peaks in (np.arange(18), np.arange(18, dtype=float)):
+            peaks[0] = -1
+
+            deltas = self.analyzer.get_peaks_delta(peaks, frq)
+
+            self.assertTrue(np.isnan(deltas[0]))
+            np.testing.assert_allclose(deltas[1:], self.analyzer.get_peaks_delta(np.arange(18), frq)[1:])
+
+    def test_fit_all_clusters_matches_sum_of_lorentzians(self):
+        x = np.linspace(2.77e9, 2.96e9, 500)
+        params = np.ravel([[0.5, centre, 1e6] for centre in np.linspace(2.78e9, 2.95e9, 18)])
+
+        expected = np.zeros_like(x)
+        for i in range(0, len(params), 3):
+            expected += self.analyzer.lorentzian(x, *params[i:i + 3])
+
+        np.testing.assert_allclose(self.analyzer.fit_all_clusters(x, *params), expected)
+        with self.assertRaises(ValueError):
+            self.analyzer.fit_all_clusters(x, *params[:-3])
+
+    def test_multi_lorentzian_jacobian(self):
+        x = np.linspace(-5, 5, 50)
+        params = np.array([0.5, -1.0, 0.7, 0.3, 1.5, 0.4])
+
+        jacobian = self.analyzer.multi_lorentzian_jacobian(x, *params)
+
+        step = 1e-6
+        for i in range(len(params)):
+            shifted_up, shifted_down = params.copy(), params.copy()
+            shifted_up[i] += step
+            shifted_down[i] -= step
+            expected = (self.analyzer.multi_lorentzian(x, *shifted_up) -
+                        self.analyzer.multi_lorentzian(x, *shifted_down)) / (2 * step)
+            np.testing.assert_allclose(jacobian[:, i], expected, atol=1e-7)
+
+    def test_curve_fitting_by_cluster_keeps_failures_local(self):
+        x = np.linspace(0, 60, 1200)
+        centres = [centre + offset for centre in range(5, 60, 10) for offset in (-1.5, 0, 1.5)]
+        params = np.ravel([[0.05, centre, 0.1] for centre in centres])
+        y = 1 + self.analyzer.multi_lorentzian(x, *params)
+        peaks = np.array([np.argmin(np.abs(x - centre)) for centre in centres])
+        peaks[3] = -1
+
+        popt, pcov = self.analyzer.curve_fitting_by_cluster(x, y, peaks, [200] * 6)
+
+        self.assertEqual(popt.shape, (54,))
+        self.assertEqual(pcov.shape, (54, 54))
+        self.assertTrue(np.all(np.isnan(popt[9:18])))
+        healthy = np.delete(np.arange(18), np.s_[3:6])
+        np.testing.assert_allclose(popt[1::3][healthy], np.asarray(centres)[healthy], atol=0.01)
+        np.testing.assert_allclose(np.abs(popt[2::3][healthy]), 0.1, atol=0.01)
+
+    def test_curve_fitting_by_cluster_flags_diverged_clusters(self):
+        x = np.linspace(0, 60, 600)
+        centres = [centre + offset for centre in range(5, 60, 10) for offset in (-1.5, 0, 1.5)]
+        params = np.ravel([[1.0, centre, 0.3] for centre in centres])
+        y = self.analyzer.multi_lorentzian(x, *params)
+        peaks = np.array([np.argmin(np.abs(x - centre)) for centre in centres])
+
+        popt, pcov = self.analyzer.curve_fitting_by_cluster(x, y, peaks, [100] * 6, depth=1, polish=True)
+
+        self.assertTrue(np.all(np.isnan(popt)))
+        self.assertTrue(np.all(np.isinf(np.diag(pcov))))
+
+    def test_serpentine_pixels_visits_neighbours_in_turn(self):
+        order = self.analyzer.serpentine_pixels((3, 4))
+
+        np.testing.assert_array_equal(order, [0, 1, 2, 3, 7, 6, 5, 4, 8, 9, 10, 11])
+        np.testing.assert_array_equal(self.analyzer.serpentine_pixels((3, 4), rows=(1, 2)), [4, 5, 6, 7])
+
+    def test_curve_fitting_image_with_warm_start(self):
+        x = np.linspace(0, 60, 600)
+        data = np.empty((600, 2, 3))
+        peaks = np.empty((18, 2, 3), dtype=int)
+        true_centres = np.empty((18, 2, 3))
+        for row in range(2):
+            for col in range(3):
+                centres = [centre + offset + 0.05 * (row + col) for centre in range(5, 60, 10)
+                           for offset in (-1.5, 0, 1.5)]
+                true_centres[:, row, col] = centres
+                data[:, row, col] = self.analyzer.multi_lorentzian(x, *np.ravel([[1.0, c, 0.3] for c in centres]))
+                peaks[:, row, col] = [np.argmin(np.abs(x - centre)) for centre in centres]
+
+        cold = self.analyzer.curve_fitting_image(x, data, peaks, step_intervals=[100] * 6)
+        cold_nfev = self.analyzer.metrics.stages["curve_fitting_cluster"]["nfev"]
+        self.analyzer.metrics.reset()
+        warm = self.analyzer.curve_fitting_image(x, data, peaks, step_intervals=[100] * 6, warm_start=True)
+        warm_nfev = self.analyzer.metrics.stages["curve_fitting_cluster"]["nfev"]
+
+        self.assertLessEqual(np.max(np.abs(warm[1::3] - true_centres)), np.max(np.abs(cold[1::3] - true_centres)))
+        self.assertLess(warm_nfev, cold_nfev)
+        self.assertNotIn("warm_start_fallback", self.analyzer.metrics.stages)
+
+    def test_warm_start_falls_back_to_guesses_when_fit_diverges(self):
+        analyzer = DivergingWarmStartPeakAnalyzer('data/')
+        x = np.linspace(0, 60, 600)
+        data = np.ones((600, 1, 3))
+        peaks = np.tile(np.arange(0, 540, 30)[:, None, None], (1, 1, 3))
+
+        popt = analyzer.curve_fitting_image(x, data, peaks, warm_start=True)
+
+        np.testing.assert_array_equal(popt[1::3], np.tile(x[peaks[:, 0, :1]], (1, 3))[:, None, :])
+        self.assertEqual(analyzer.seeded_fits, 2)
+        self.assertEqual(analyzer.metrics.stages["warm_start_fallback"]["calls"], 2)
+
+    def test_normalise_dataset_in_blocks_is_exact(self):
+        data = np.random.uniform(100, 1000, (2, 23, 11, 6, 5))
+
+        expected = self.analyzer.normalise_dataset(data)
+
+        for block_size in (1, 4, 23, 100):
+            normalised = self.analyzer.normalise_dataset(data, block_size=block_size)
+            self.assertEqual(normalised.dtype, expected.dtype)
+            np.testing.assert_array_equal(normalised, expected)
+        with self.assertRaises(ValueError):
+            self.analyzer.normalise_dataset(data, block_size=0)
+
+    def test_load_metadata_uses_and_invalidates_sidecar(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = os.path.join(tmp_dir, "acquisition")
+            with open(f"{fname}.yaml", "w") as f:
+                yaml.safe_dump({"step_intervals": [2, 2], "frequency_values": [1.0, 2.0, 3.0, 4.0]}, f)
+
+            frq, step_intervals = self.analyzer.load_metadata(fname)
+
+            self.assertTrue(os.path.isfile(f"{fname}.meta.npz"))
+            np.testing.assert_array_equal(frq, [1.0, 2.0, 3.0, 4.0])
+            np.testing.assert_array_equal(step_intervals, [2, 2])
+            reloaded_frq, _ = PeakAnalyzer(self.data_folder).load_metadata(fname)
+            np.testing.assert_array_equal(reloaded_frq, frq)
+
+            with open(f"{fname}.yaml", "w") as f:
+                yaml.safe_dump({"step_intervals": [1, 1], "frequency_values": [5.0, 6.0]}, f)
+            os.utime(f"{fname}.yaml", ns=(0, 0))
+            frq, step_intervals = self.analyzer.load_metadata(fname)
+            np.testing.assert_array_equal(frq, [5.0, 6.0])
+            np.testing.assert_array_equal(step_intervals, [1, 1])
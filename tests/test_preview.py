@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.batch import BatchRunner
+from peakanalyzer.preview import PreviewRunner
+from peakanalyzer.synthetic import generate_dataset, save_dataset
+
+
+class RecordingFitPeakAnalyzer(PeakAnalyzer):
+    # Records how the image fits are called instead of fitting
+    def __init__(self, datafolder):
+        super().__init__(datafolder)
+        self.fit_calls = []
+
+    def curve_fitting_image(self, frq, data, peaks, step_intervals=None, depth=200000, workers=None,
+                            warm_start=False):
+        self.fit_calls.append((data.shape[1:], warm_start))
+        return np.full((54,) + data.shape[1:], np.nan)
+
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+
+    def test_bin_and_expand_image(self):
+        data = np.arange(2 * 5 * 3, dtype=float).reshape(2, 5, 3)
+
+        binned = self.analyzer.bin_image(data, 2)
+
+        self.assertEqual(binned.shape, (2, 3, 2))
+        np.testing.assert_allclose(binned[:, 0, 0], np.mean(data[:, :2, :2], axis=(1, 2)))
+        np.testing.assert_allclose(binned[:, 2, 1], data[:, 4, 2])
+        expanded = self.analyzer.expand_image(binned, 2, (5, 3))
+        self.assertEqual(expanded.shape, (2, 5, 3))
+        np.testing.assert_array_equal(expanded[:, 1, 1], binned[:, 0, 0])
+
+    def test_preview_refines_region_of_interest_at_full_resolution(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            idle_fname, active_fname = os.path.join(tmp_dir, "idle"), os.path.join(tmp_dir, "active")
+            save_dataset(idle_fname, *generate_dataset(self.analyzer, height=16, width=16, max_shift=0, seed=0)[:3])
+            save_dataset(active_fname, *generate_dataset(self.analyzer, height=16, width=16, max_shift=2e6,
+                                                         seed=1)[:3])
+            runner = BatchRunner(self.analyzer, window_length=20)
+            _, shift_maps = runner.run([idle_fname], [active_fname])
+
+            preview = PreviewRunner(runner, factor=4, threshold=300e3, margin=0).run(idle_fname, active_fname)
+
+        full_shift_map = shift_maps[(idle_fname, active_fname)]
+        self.assertEqual(preview.coarse_shift_map.shape, (3, 4, 4))
+        self.assertEqual(preview.shift_map.shape, (3, 16, 16))
+        self.assertTrue(preview.roi[8, 8])
+        self.assertFalse(preview.roi[0, 0])
+        np.testing.assert_array_equal(preview.shift_map[:, preview.roi], full_shift_map[:, preview.roi])
+        coarse_map = self.analyzer.expand_image(preview.coarse_shift_map, 4, (16, 16))
+        np.testing.assert_array_equal(preview.shift_map[:, ~preview.roi], coarse_map[:, ~preview.roi])
+        self.assertIsNone(preview.active_popt)
+
+    def test_region_of_interest_is_fitted_without_warm_start(self):
+        analyzer = RecordingFitPeakAnalyzer('data_dir/')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            idle_fname, active_fname = os.path.join(tmp_dir, "idle"), os.path.join(tmp_dir, "active")
+            save_dataset(idle_fname, *generate_dataset(analyzer, height=8, width=8, max_shift=0, seed=0)[:3])
+            save_dataset(active_fname, *generate_dataset(analyzer, height=8, width=8, max_shift=2e6, seed=1)[:3])
+            runner = BatchRunner(analyzer, window_length=20, fit=True, warm_start=True)
+
+            preview = PreviewRunner(runner, factor=4, threshold=0, margin=0).run(idle_fname, active_fname)
+
+        self.assertTrue(np.any(preview.roi))
+        self.assertEqual(analyzer.fit_calls, [((int(np.sum(preview.roi)),), False)] * 2)
+        self.assertEqual(preview.idle_popt.shape, (54, 8, 8))
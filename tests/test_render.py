@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.render import Renderer, decimate_trace
+
+
+class TestRender(unittest.TestCase):
+    def test_decimate_trace_keeps_extremes(self):
+        x = np.arange(10000)
+        y = np.sin(x / 100)
+        y[5003] = -5
+
+        decimated_x, decimated_y = decimate_trace(x, y, 500)
+
+        self.assertLessEqual(len(decimated_x), 500)
+        self.assertEqual(decimated_x[np.argmin(decimated_y)], 5003)
+        self.assertEqual(decimated_y.max(), y.max())
+        self.assertIs(decimate_trace(x, y, None)[1], y)
+
+    def test_file_mode_writes_figures_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            analyzer = PeakAnalyzer('data_dir/', renderer=Renderer("file", output_dir=tmp_dir))
+            x = np.linspace(2.8e9, 2.9e9, 5000)
+            y = np.cos(x * 1e-7)
+
+            analyzer.visualise_peaks(x, y, np.array([10, 20]), title="Peaks")
+            analyzer.plot_image(np.eye(5), title="Image")
+            analyzer.renderer.close()
+
+            self.assertEqual(analyzer.renderer.errors, [])
+            self.assertEqual(sorted(name.split("_", 1)[1] for name in os.listdir(tmp_dir)),
+                             ["0001_peaks.png", "0002_image.png"])
+
+    def test_off_mode_renders_nothing(self):
+        renderer = Renderer("off")
+
+        renderer.render(None, (1, 1))
+        renderer.render_line([1, 2], [3, 4], title="Line")
+
+        self.assertIsNone(renderer._thread)
+        with self.assertRaises(ValueError):
+            Renderer("window")
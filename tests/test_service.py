@@ -0,0 +1,170 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.batch import BatchRunner
+from peakanalyzer.cache import StageCache
+from peakanalyzer.calibration import CalibrationStore
+from peakanalyzer.catalog import AcquisitionCatalog
+from peakanalyzer.service import AnalysisClient, AnalysisService
+from peakanalyzer.synthetic import generate_dataset, save_dataset
+
+
+class BlockingBatchRunner(BatchRunner):
+    # Holds every job in the worker until released
+    def __init__(self, analyzer, **kwargs):
+        super().__init__(analyzer, **kwargs)
+        self.release = threading.Event()
+
+    def preprocess_in_worker(self, fname):
+        self.release.wait()
+        return super().preprocess_in_worker(fname)
+
+
+class TestService(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.idle_fname = os.path.join(self.tmp_dir.name, "idle")
+        self.active_fname = os.path.join(self.tmp_dir.name, "active")
+        save_dataset(self.idle_fname, *generate_dataset(self.analyzer, height=4, width=4, max_shift=0, seed=0)[:3])
+        save_dataset(self.active_fname, *generate_dataset(self.analyzer, height=4, width=4, max_shift=1e6,
+                                                          seed=1)[:3])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_job_streams_progress_and_caches_result(self):
+        runner = BatchRunner(self.analyzer, window_length=20)
+
+        async def run():
+            async with AnalysisService(runner, workers=1, executor=ThreadPoolExecutor(1)) as service:
+                job = await service.submit(self.idle_fname, self.active_fname)
+                events = [event async for event in job.events()]
+                cached_job = await service.submit(self.idle_fname, self.active_fname)
+                cached_events = [event async for event in cached_job.events()]
+            return events, cached_events
+
+        events, cached_events = asyncio.run(run())
+
+        self.assertEqual([event["event"] for event in events], ["queued", "started", "partial", "partial", "done"])
+        self.assertEqual([event["role"] for event in events[2:4]], ["idle", "active"])
+        self.assertFalse(events[-1]["cached"])
+        _, shift_maps = BatchRunner(self.analyzer, window_length=20).run([self.idle_fname], [self.active_fname])
+        np.testing.assert_array_equal(np.array(events[-1]["shift_map"], dtype=float),
+                                      shift_maps[(self.idle_fname, self.active_fname)])
+        self.assertEqual([event["event"] for event in cached_events], ["done"])
+        self.assertTrue(cached_events[0]["cached"])
+        self.assertEqual(cached_events[0]["shift_map"], events[-1]["shift_map"])
+
+    def test_full_queue_holds_back_submissions(self):
+        runner = BlockingBatchRunner(self.analyzer, window_length=20)
+        other_fname = os.path.join(self.tmp_dir.name, "other")
+        save_dataset(other_fname, *generate_dataset(self.analyzer, height=4, width=4, max_shift=1e6, seed=2)[:3])
+
+        async def run():
+            async with AnalysisService(runner, workers=1, max_queue=1, executor=ThreadPoolExecutor(1)) as service:
+                running_job = await service.submit(self.idle_fname, self.active_fname)
+                await asyncio.sleep(0.1)
+                queued_job = await service.submit(self.idle_fname, other_fname)
+                # The worker is busy and the queue is full, the next submission has to wait
+                waiting = asyncio.create_task(service.submit(self.active_fname, other_fname))
+                await asyncio.sleep(0.1)
+                self.assertFalse(waiting.done())
+                # Resubmitting a queued job attaches to it instead of queueing it again
+                self.assertIs(await service.submit(self.idle_fname, other_fname), queued_job)
+                runner.release.set()
+                jobs = [running_job, queued_job, await waiting]
+                return [[event async for event in job.events()][-1]["event"] for job in jobs]
+
+        self.assertEqual(asyncio.run(run()), ["done", "done", "done"])
+
+    def test_catalog_calibrations_and_results_persist(self):
+        datafolder = os.path.join(self.tmp_dir.name, "data") + "/"
+        idle_fname = datafolder + "without_current/ESR_Continuous_2024-03-07-17-46-03_PCB_ref_4x4"
+        active_fname = datafolder + "with_current/ESR_Continuous_2024-03-07-17-58-48_PCB_Top_25mA_4x4"
+        for fname, source in ((idle_fname, self.idle_fname), (active_fname, self.active_fname)):
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            for extension in ("npy", "yaml"):
+                os.replace(f"{source}.{extension}", f"{fname}.{extension}")
+        catalog = AcquisitionCatalog(os.path.join(self.tmp_dir.name, "catalog.sqlite"))
+        calibrations = CalibrationStore(os.path.join(self.tmp_dir.name, "calibrations"))
+
+        async def run(active_fname):
+            # A new runner and service every time, as after a restart
+            runner = BatchRunner(self.analyzer, window_length=20, calibrations=calibrations,
+                                 cache=StageCache(os.path.join(self.tmp_dir.name, "cache")))
+            async with AnalysisService(runner, workers=1, executor=ThreadPoolExecutor(1), catalog=catalog,
+                                       datafolder=datafolder) as service:
+                job = await service.submit(idle_fname, active_fname)
+                return [event async for event in job.events()]
+
+        events = asyncio.run(run(active_fname))
+        restarted_events = asyncio.run(run(active_fname))
+        other_fname = datafolder + "with_current/ESR_Continuous_2024-03-07-18-10-00_PCB_Top_50mA_4x4"
+        save_dataset(other_fname, *generate_dataset(self.analyzer, height=4, width=4, max_shift=1e6, seed=2)[:3])
+        other_events = asyncio.run(run(other_fname))
+
+        self.assertEqual(catalog.query(role="idle", datafolder=datafolder), [idle_fname])
+        self.assertEqual(catalog.query(role="active", datafolder=datafolder), [active_fname, other_fname])
+        self.assertFalse(events[2]["calibrated"])
+        self.assertTrue(os.path.exists(calibrations.path(idle_fname)))
+        self.assertEqual([event["event"] for event in restarted_events], ["done"])
+        self.assertTrue(restarted_events[0]["cached"])
+        self.assertEqual(restarted_events[0]["shift_map"], events[-1]["shift_map"])
+        self.assertTrue(other_events[2]["calibrated"])
+        self.assertEqual(other_events[-1]["event"], "done")
+
+    def test_jobs_run_in_worker_processes(self):
+        # The runner, its stage cache and its calibrations are pickled to the process pool
+        calibrations = CalibrationStore(os.path.join(self.tmp_dir.name, "calibrations"))
+        runner = BatchRunner(self.analyzer, window_length=20, block_size=16, calibrations=calibrations,
+                             cache=StageCache(os.path.join(self.tmp_dir.name, "cache")))
+        other_fname = os.path.join(self.tmp_dir.name, "other")
+        save_dataset(other_fname, *generate_dataset(self.analyzer, height=4, width=4, max_shift=1e6, seed=2)[:3])
+
+        async def run():
+            async with AnalysisService(runner, workers=2) as service:
+                jobs = [await service.submit(self.idle_fname, active_fname)
+                        for active_fname in (self.active_fname, other_fname)]
+                return [[event async for event in job.events()] for job in jobs]
+
+        events = asyncio.run(run())
+
+        self.assertEqual([job_events[-1]["event"] for job_events in events], ["done", "done"])
+        self.assertEqual(runner.errors, {})
+        self.assertGreater(self.analyzer.metrics.stages["normalise_dataset"]["calls"], 0)
+        _, shift_maps = BatchRunner(self.analyzer, window_length=20).run([self.idle_fname], [self.active_fname])
+        np.testing.assert_array_equal(np.array(events[0][-1]["shift_map"], dtype=float),
+                                      shift_maps[(self.idle_fname, self.active_fname)])
+        self.assertIsNotNone(calibrations.load(self.idle_fname, runner.calibration_params()))
+
+    def test_client_over_tcp(self):
+        runner = BatchRunner(self.analyzer, window_length=20)
+
+        async def run():
+            async with AnalysisService(runner, workers=1, executor=ThreadPoolExecutor(1)) as service:
+                server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+                client = AnalysisClient("127.0.0.1", server.sockets[0].getsockname()[1], timeout=60)
+                async with server:
+                    events = await asyncio.to_thread(lambda: list(client.submit(self.idle_fname,
+                                                                                self.active_fname)))
+                    missing = await asyncio.to_thread(lambda: list(client.submit("missing", self.active_fname)))
+                    status = await asyncio.to_thread(client.status)
+            return events, missing, status
+
+        events, missing, status = asyncio.run(run())
+
+        self.assertEqual(events[-1]["event"], "done")
+        self.assertEqual(np.array(events[-1]["shift_map"], dtype=float).shape, (3, 4, 4))
+        self.assertEqual(len(events[-1]["mean_shift"]), 3)
+        self.assertEqual([event["event"] for event in missing], ["error"])
+        self.assertEqual(status["queued"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import queue
+import tempfile
+import threading
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.streaming import StreamingAnalyzer, file_blocks, queue_blocks
+from peakanalyzer.synthetic import generate_dataset
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+        self.frq, self.raw, self.step_intervals, _ = generate_dataset(self.analyzer, height=3, width=4, seed=0)
+        data = self.analyzer.normalise_dataset(self.raw)
+        self.frq_clipped, self.smooth, _, self.peaks = self.analyzer.analyse_dataset(
+            self.frq, data, self.step_intervals, window_length=20)
+
+    def blocks(self, block_size):
+        return (self.raw[:, start:start + block_size] for start in range(0, len(self.frq), block_size))
+
+    def test_streamed_result_matches_full_sweep(self):
+        for block_size in (1, 37, 151, len(self.frq)):
+            streaming = StreamingAnalyzer(self.analyzer, self.frq, self.step_intervals, window_length=20)
+
+            result = streaming.run(self.blocks(block_size))
+
+            np.testing.assert_array_equal(result.smooth, self.smooth)
+            np.testing.assert_array_equal(result.peaks, self.peaks)
+            np.testing.assert_array_equal(result.deltas, self.analyzer.get_peaks_delta_batch(self.peaks,
+                                                                                             self.frq_clipped))
+
+    def test_clusters_are_emitted_with_partial_deltas(self):
+        streaming = StreamingAnalyzer(self.analyzer, self.frq, self.step_intervals, window_length=20)
+        clusters = []
+        for block in self.blocks(151):
+            clusters.extend(streaming.push(block))
+            self.assertEqual(streaming.complete, len(clusters) == 6)
+
+        self.assertEqual([cluster.cluster_index for cluster in clusters], list(range(6)))
+        np.testing.assert_array_equal(clusters[1].peaks, self.peaks[3:6])
+        known_deltas = [np.all(np.isfinite(cluster.deltas), axis=(1, 2)).tolist() for cluster in clusters]
+        self.assertEqual(known_deltas, [[False] * 3] * 3 + [[False, False, True], [False, True, True], [True] * 3])
+        with self.assertRaises(ValueError):
+            streaming.push(self.raw[:, :1])
+
+    def test_queue_blocks(self):
+        block_queue = queue.Queue()
+        for block in self.blocks(100):
+            block_queue.put(block)
+        block_queue.put(None)
+
+        result = StreamingAnalyzer(self.analyzer, self.frq, self.step_intervals, window_length=20).run(
+            queue_blocks(block_queue, timeout=1))
+
+        np.testing.assert_array_equal(result.peaks, self.peaks)
+
+    def test_file_blocks_follow_a_growing_file(self):
+        frames = np.ascontiguousarray(np.moveaxis(self.raw, 1, 0))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "sweep.bin")
+
+            def acquire():
+                with open(path, "ab") as f:
+                    for start in range(0, len(frames), 200):
+                        f.write(frames[start:start + 200].tobytes())
+                        f.flush()
+
+            writer = threading.Thread(target=acquire)
+            writer.start()
+            result = StreamingAnalyzer(self.analyzer, self.frq, self.step_intervals, window_length=20).run(
+                file_blocks(path, frames.shape[1:], len(frames), dtype=frames.dtype, poll_interval=0.01, timeout=5))
+            writer.join()
+
+        np.testing.assert_array_equal(result.smooth, self.smooth)
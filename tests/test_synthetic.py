@@ -0,0 +1,64 @@
+import unittest
+import numpy as np
+from peakanalyzer.peakanalyzer import PeakAnalyzer
+from peakanalyzer.synthetic import generate_dataset
+
+
+class TestSynthetic(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = PeakAnalyzer('data_dir/')
+
+    def test_generate_dataset_shapes(self):
+        frq, raw, step_intervals, true_centres = generate_dataset(self.analyzer, height=3, width=4,
+                                                                  points_per_interval=50, num_sweeps=2, seed=0)
+
+        self.assertEqual(frq.shape, (300,))
+        self.assertEqual(raw.shape, (2, 300, 2, 3, 4))
+        np.testing.assert_array_equal(step_intervals, [50] * 6)
+        self.assertEqual(true_centres.shape, (18, 3, 4))
+        self.assertTrue(np.all(np.diff(true_centres, axis=0) > 0))
+
+    def test_detected_dips_match_true_centres(self):
+        frq, raw, step_intervals, true_centres = generate_dataset(self.analyzer, height=5, width=5, seed=0)
+
+        data = self.analyzer.normalise_dataset(raw)
+        frq_clipped, _, _, peaks = self.analyzer.analyse_dataset(frq, data, step_intervals, window_length=20)
+
+        self.assertTrue(np.all(peaks >= 0))
+        grid_step = frq[1] - frq[0]
+        self.assertLess(np.max(np.abs(frq_clipped[peaks] - true_centres)), 3 * grid_step)
+        deltas = self.analyzer.get_peaks_delta_batch(peaks, frq_clipped)
+        self.assertGreater(deltas[0, 2, 2], deltas[0, 0, 0])
+
+    def test_fits_from_default_guesses_match_true_centres(self):
+        # The smoothing shifts the dips by about 66 kHz, the fits have to stay close to that
+        frq, raw, step_intervals, true_centres = generate_dataset(self.analyzer, height=3, width=3, seed=0)
+
+        data = self.analyzer.normalise_dataset(raw)
+        frq_clipped, smooth_clipped, clipped_step_intervals, peaks = self.analyzer.analyse_dataset(
+            frq, data, step_intervals, window_length=20)
+        popt = self.analyzer.curve_fitting_image(frq_clipped, smooth_clipped, peaks,
+                                                 step_intervals=clipped_step_intervals)
+
+        self.assertLess(np.max(np.abs(popt[1::3] - true_centres)), 150e3)
+
+    def test_float32_deltas_stay_within_tolerance_of_float64(self):
+        # On the bundled frequency axis at least 99% of the pixels of every delta map agree within
+        # 1 kHz, and the medians exactly. The remaining pixels have two nearly equally deep dip
+        # candidates, of which single precision may pick the other one.
+        frq, step_intervals = self.analyzer.load_metadata(
+            'data_dir/without_current/ESR_Continuous_2024-03-07-17-46-03_PCB_ref_50x50')
+        _, raw, _, _ = generate_dataset(self.analyzer, height=16, width=16, frq=frq, step_intervals=step_intervals,
+                                        seed=7)
+        deltas = {}
+        for dtype in (np.float64, np.float32):
+            data = self.analyzer.normalise_dataset(raw, block_size=64, dtype=dtype)
+            frq_clipped, smooth_clipped, _, peaks = self.analyzer.analyse_dataset(frq, data, step_intervals,
+                                                                                  window_length=20)
+            self.assertEqual(smooth_clipped.dtype, dtype)
+            deltas[dtype] = self.analyzer.get_peaks_delta_batch(peaks, frq_clipped)
+
+        difference = np.abs(deltas[np.float32] - deltas[np.float64])
+        self.assertTrue(np.all(np.mean(difference <= 1e3, axis=(1, 2)) >= 0.99))
+        np.testing.assert_array_equal(np.median(deltas[np.float32], axis=(1, 2)),
+                                      np.median(deltas[np.float64], axis=(1, 2)))